@@ -1,75 +1,380 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, Query, Depends, HTTPException
-from fastapi.responses import Response
+from fastapi.responses import RedirectResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from dotenv import load_dotenv
 import httpx
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import os
 from datetime import datetime
 import json
-import boto3
+import asyncio
+import base64
+import hashlib
+import re
 
-load_dotenv()
+from image_cache import ImageLRU, cached_image, image_response
+from token_verifier import TokenVerifier, UnknownKeyError
+from sqs_batcher import SqsBatcher
+from tile_batcher import TileBatcher
+from image_formats import IMAGE_FORMAT, get_format
+import metrics
+from startup import Warmup, aws_client, health_routes, once
 
-app = FastAPI()
+load_dotenv()
 
 AUTH_SERVICE_URL = os.getenv("AUTH_SERVICE_URL")
 DATA_SERVICE_URL = os.getenv("DATA_SERVICE_URL")
 SQS_QUEUE_URL = os.getenv("SQS_QUEUE_URL")
 AWS_REGION = os.getenv("AWS_REGION", "ap-southeast-2")
 
-sqs = boto3.client("sqs", region_name=AWS_REGION)
+# local token verification; without JWKS_URL every token goes to auth-service
+JWKS_URL = os.getenv("JWKS_URL")
+COGNITO_CLIENT_ID = os.getenv("COGNITO_CLIENT_ID")
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+
+# shared outbound connection pool
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "5"))
+HTTP2 = os.getenv("HTTP2", "0") == "1"  # needs the h2 package
+
+# task enqueue micro-batching
+SQS_BATCH_LINGER = float(os.getenv("SQS_BATCH_LINGER", "0.005"))
+SQS_BATCH_BUFFER = int(os.getenv("SQS_BATCH_BUFFER", "1000"))
+SQS_BATCH_IN_FLIGHT = int(os.getenv("SQS_BATCH_IN_FLIGHT", "8"))
+
+# /get delivery: "proxy" (buffer, cache and serve), "stream" (pipe S3 through
+# in chunks) or "redirect" (302 to the presigned URL)
+GET_DELIVERY_MODE = os.getenv("GET_DELIVERY_MODE", "proxy")
+IMAGE_CACHE_CONTROL = os.getenv("IMAGE_CACHE_CONTROL", "public, max-age=86400, immutable")
+# in-process image LRU, per uvicorn worker: each of the Dockerfile's 4
+# workers holds its own copy (up to 4x this in memory) and sees only its
+# share of the hits. 0 disables it
+IMAGE_CACHE_BYTES = int(os.getenv("IMAGE_CACHE_BYTES", str(64 * 1024 * 1024)))
+IMAGE_CACHE_MAX_ITEM_BYTES = int(os.getenv("IMAGE_CACHE_MAX_ITEM_BYTES", str(16 * 1024 * 1024)))
+# response headers passed through from S3 in stream mode
+STREAM_HEADERS = ("content-type", "content-length", "content-range", "accept-ranges", "etag", "last-modified")
+
+# map tiles, rendered in batches by compute-service's tile_server
+TILE_SERVICE_URL = os.getenv("TILE_SERVICE_URL")
+TILE_MAX_ZOOM = int(os.getenv("TILE_MAX_ZOOM", "16"))
+TILE_BATCH_LINGER = float(os.getenv("TILE_BATCH_LINGER", "0.01"))
+TILE_MAX_BATCH = int(os.getenv("TILE_MAX_BATCH", "64"))
+TILE_RENDER_TIMEOUT = float(os.getenv("TILE_RENDER_TIMEOUT", "60"))
+TILE_CACHE_CONTROL = os.getenv("TILE_CACHE_CONTROL", "public, max-age=86400")
+# palette names (matplotlib colormaps like "viridis" or "Blues_r") go into
+# the tile's storage key, so nothing else may reach it
+TILE_PALETTE_NAME = re.compile(r"[A-Za-z0-9_]{1,64}")
+
+# same table as compute-service's get_size_dimensions
+SIZE_DIMENSIONS = {
+    "s": (1000, 563),
+    "m": (2000, 1125),
+    "l": (3000, 1688),
+    "xl": (4000, 2250),
+    "xxl": (5000, 2813),
+    "verybig": (8000, 4500),
+}
+
+# (lane, max pixels) cheapest first; each lane may have its own queue
+LANES = [("small", 2250000), ("medium", 9000000), ("large", None)]
+# compute-service renderers a job can ask for; unset means RENDER_MODE, which
+# must match compute-service's default. non-full modes are part of the file name
+RENDER_MODES = ("full", "subdivide")
+RENDER_MODE = os.getenv("RENDER_MODE", "full")
+# generated files are named for the format the worker encodes them in
+IMAGE_EXTENSION = get_format(IMAGE_FORMAT).extension
+
+LANE_QUEUE_URLS = {
+    name: os.getenv(f"SQS_QUEUE_URL_{name.upper()}", SQS_QUEUE_URL)
+    for name, _ in LANES
+}
+
+
+@once
+def get_sqs():
+    return aws_client("sqs", region_name=AWS_REGION)
+
+
+sqs_batcher = SqsBatcher(get_sqs, SQS_BATCH_BUFFER, SQS_BATCH_LINGER, SQS_BATCH_IN_FLIGHT)
 security = HTTPBearer(auto_error=False)
+http_client = None
+image_cache = ImageLRU(IMAGE_CACHE_BYTES, IMAGE_CACHE_MAX_ITEM_BYTES) if IMAGE_CACHE_BYTES > 0 else None
+
+
+def get_http_client():
+    global http_client
+    if http_client is None:
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+            timeout=HTTP_TIMEOUT,
+            http2=HTTP2,
+            event_hooks={"request": [metrics.add_trace_header]},
+        )
+    return http_client
+
+
+token_verifier = TokenVerifier(get_http_client, JWKS_URL, COGNITO_CLIENT_ID, TOKEN_CACHE_SIZE) if JWKS_URL else None
+
+# until the JWKS is in, tokens are verified by auth-service
+warmup = Warmup(
+    {"sqs": get_sqs, **({"jwks": token_verifier.refresh} if token_verifier else {})},
+    optional=("jwks",),
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    get_http_client()
+    sqs_batcher.start()
+    async with warmup.lifespan():
+        yield
+    await sqs_batcher.close()
+    global http_client
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
+
+
+app = FastAPI(lifespan=lifespan)
+metrics.instrument(app, "api-gateway")
+health_routes(app, warmup)
+metrics.register_stats("sqs_batcher", lambda: sqs_batcher.stats)
+if image_cache:
+    metrics.register_stats("image_cache", lambda: image_cache.stats)
+
+
+def job_cost(size: str):
+    w, h = SIZE_DIMENSIONS.get(size.lower(), (2000, 1125))
+    return w * h
+
+
+def job_lane(cost: int):
+    for name, max_pixels in LANES:
+        if max_pixels is None or cost <= max_pixels:
+            return name
 
 @app.get("/get/{file_name}")
-async def get_image(file_name: str):
-    async with httpx.AsyncClient() as client:
-        try:
-            res = await client.get(f"{DATA_SERVICE_URL}/s3/url/{file_name}")
-            res.raise_for_status()
-            url = res.json().get("url")
-            if not url:
-                raise HTTPException(status_code=404, detail=f"No URL found for file: {file_name}")
+async def get_image(file_name: str, request: Request):
+    if_none_match = request.headers.get("if-none-match")
+    range_header = request.headers.get("range")
 
-            image_res = await client.get(url)
-            image_res.raise_for_status()
+    item = image_cache.get(file_name) if image_cache else None
+    if item is not None:
+        return image_response(item, if_none_match, range_header, IMAGE_CACHE_CONTROL)
 
-            return Response(content=image_res.content, media_type="image/png")
+    client = get_http_client()
+    try:
+        res = await client.get(f"{DATA_SERVICE_URL}/s3/url/{file_name}")
+        res.raise_for_status()
+        url = res.json().get("url")
+        if not url:
+            raise HTTPException(status_code=404, detail=f"No URL found for file: {file_name}")
 
-        except httpx.HTTPStatusError as e:
-            raise HTTPException(status_code=e.response.status_code, detail=str(e))
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=str(e))
+        if GET_DELIVERY_MODE == "redirect":
+            # the presigned URL expires, so the redirect itself must not be cached
+            return RedirectResponse(url, status_code=302, headers={"Cache-Control": "no-store"})
+
+        if GET_DELIVERY_MODE == "stream":
+            return await stream_image(client, url, if_none_match, range_header)
+
+        image_res = await client.get(url)
+        image_res.raise_for_status()
+
+        item = cached_image(
+            content=image_res.content,
+            etag=image_res.headers.get("etag"),
+            media_type=image_res.headers.get("content-type", "image/png"),
+        )
+        if image_cache:
+            image_cache.put(file_name, item)
+        return image_response(item, if_none_match, range_header, IMAGE_CACHE_CONTROL)
+
+    except HTTPException:
+        raise
+    except httpx.HTTPStatusError as e:
+        raise HTTPException(status_code=e.response.status_code, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+async def stream_image(client, url: str, if_none_match: str, range_header: str):
+    # conditional and range requests are answered by S3 itself
+    upstream_headers = {}
+    if if_none_match:
+        upstream_headers["If-None-Match"] = if_none_match
+    if range_header:
+        upstream_headers["Range"] = range_header
+
+    upstream = await client.send(client.build_request("GET", url, headers=upstream_headers), stream=True)
+    if upstream.status_code >= 400 and upstream.status_code != 416:
+        await upstream.aread()
+        await upstream.aclose()
+        upstream.raise_for_status()
+
+    headers = {k: v for k, v in upstream.headers.items() if k.lower() in STREAM_HEADERS}
+    headers["Cache-Control"] = IMAGE_CACHE_CONTROL
+    return StreamingResponse(
+        upstream.aiter_raw(),
+        status_code=upstream.status_code,
+        headers=headers,
+        background=BackgroundTask(upstream.aclose),
+    )
 
 async def optional_auth(credentials: HTTPAuthorizationCredentials = Depends(security)):
     if not credentials:
         return None
 
     token = credentials.credentials
-    async with httpx.AsyncClient() as client:
+    if token_verifier:
         try:
-            res = await client.post(
-                f"{AUTH_SERVICE_URL}/verify-token",
-                json={"token": token}
-            )
-            res.raise_for_status()
-            return res.json()
-        except httpx.HTTPStatusError as e:
-            return None
-        except Exception as e:
+            return token_verifier.verify(token)
+        except UnknownKeyError:
+            pass
+        except Exception:
             return None
+
+    # no usable local key: let auth-service decide
+    client = get_http_client()
+    try:
+        res = await client.post(
+            f"{AUTH_SERVICE_URL}/verify-token",
+            json={"token": token}
+        )
+        res.raise_for_status()
+        claims = res.json()
+        if token_verifier:
+            token_verifier.remember(token, claims)
+        return claims
+    except httpx.HTTPStatusError as e:
+        return None
+    except Exception as e:
+        return None
         
-async def get_presigned_url(key: str):
-    async with httpx.AsyncClient() as client:
-        res = await client.get(f"{DATA_SERVICE_URL}/s3/url/{key}")
+background_tasks = set()
+
+
+def in_background(coro):
+    task = asyncio.ensure_future(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+def tile_key(constant: int, palette: str, z: int, x: int, y: int):
+    return f"{constant}/{palette}/{z}/{x}/{y}.png"
+
+
+async def fetch_tile(key: str):
+    client = get_http_client()
+    res = await client.get(f"{DATA_SERVICE_URL}/tiles/{key}")
+    if res.status_code == 404:
+        return None
+    res.raise_for_status()
+    return res.content
+
+
+async def store_tile(key: str, data: bytes):
+    client = get_http_client()
+    try:
+        res = await client.put(f"{DATA_SERVICE_URL}/tiles/{key}", content=data, headers={"content-type": "image/png"})
         res.raise_for_status()
-        return res.json().get("url")
+    except Exception as e:
+        print(f"failed to store tile {key}: {e}")
+
+
+async def render_tiles(group, tiles):
+    constant, z, palette = group
+    client = get_http_client()
+    res = await client.post(
+        f"{TILE_SERVICE_URL}/tiles/render",
+        json={"constant": constant, "z": z, "tiles": tiles, "palette": palette},
+        timeout=TILE_RENDER_TIMEOUT,
+    )
+    res.raise_for_status()
+    rendered = {}
+    for tile in res.json()["tiles"]:
+        data = base64.b64decode(tile["png_base64"])
+        rendered[(tile["x"], tile["y"])] = data
+        in_background(store_tile(tile_key(constant, palette, z, tile["x"], tile["y"]), data))
+    return rendered
+
+
+tile_batcher = TileBatcher(render_tiles, TILE_BATCH_LINGER, TILE_MAX_BATCH)
+metrics.register_stats("tile_batcher", lambda: tile_batcher.stats)
+
+
+@app.get("/tiles/{constant}/{z}/{x}/{y}.png")
+async def get_tile(constant: int, z: int, x: int, y: int, request: Request, palette: str = Query("inferno")):
+    if not TILE_SERVICE_URL:
+        raise HTTPException(status_code=503, detail="tile rendering is not configured")
+    if constant < 0 or not 0 <= z <= TILE_MAX_ZOOM or not (0 <= x < 1 << z and 0 <= y < 1 << z):
+        raise HTTPException(status_code=404, detail="no such tile")
+    if not TILE_PALETTE_NAME.fullmatch(palette):
+        raise HTTPException(status_code=400, detail="invalid palette")
+
+    key = tile_key(constant, palette, z, x, y)
+    item = image_cache.get(f"tiles/{key}") if image_cache else None
+    if item is None:
+        try:
+            data = await fetch_tile(key)
+            if data is None:
+                data = await tile_batcher.get((constant, z, palette), (x, y))
+        except httpx.HTTPStatusError as e:
+            try:
+                detail = e.response.json().get("detail")
+            except ValueError:
+                detail = e.response.text
+            raise HTTPException(status_code=e.response.status_code, detail=detail)
+        except Exception as e:
+            raise HTTPException(status_code=502, detail=f"failed to render tile: {e}")
+        item = cached_image(content=data, etag=f'"{hashlib.sha1(data).hexdigest()}"', media_type="image/png")
+        if image_cache:
+            image_cache.put(f"tiles/{key}", item)
+
+    return image_response(item, request.headers.get("if-none-match"), request.headers.get("range"), TILE_CACHE_CONTROL)
+
+
+async def get_presigned_url(key: str):
+    client = get_http_client()
+    res = await client.get(f"{DATA_SERVICE_URL}/s3/url/{key}")
+    res.raise_for_status()
+    return res.json().get("url")
 
 
 async def check_cache(filename: str):
-    async with httpx.AsyncClient() as client:
-        res = await client.get(f"{DATA_SERVICE_URL}/cache/{filename}")
+    client = get_http_client()
+    res = await client.get(f"{DATA_SERVICE_URL}/cache/{filename}")
+    res.raise_for_status()
+    return res.json().get("exists", False)
+
+
+async def mark_pending(filename: str):
+    # fail open: if the marker can't be checked, queue the job anyway
+    client = get_http_client()
+    try:
+        res = await client.post(f"{DATA_SERVICE_URL}/cache/{filename}/pending")
         res.raise_for_status()
-        return res.json().get("exists", False)
+        return res.json().get("acquired", True)
+    except Exception:
+        return True
+
+
+async def clear_pending(filename: str):
+    client = get_http_client()
+    try:
+        await client.delete(f"{DATA_SERVICE_URL}/cache/{filename}/pending")
+    except Exception:
+        pass
+
+
+async def enqueue(queue_url: str, task: dict):
+    await sqs_batcher.send(queue_url, json.dumps(task))
 
 
 @app.get("/generate")
@@ -77,10 +382,15 @@ async def generate_julia(
     country: str = Query(...),
     city: str = Query(...),
     size: str = Query(...),
+    render_mode: str = Query(None),
     user=Depends(optional_auth)
 ):
     groups = user.get("cognito:groups", []) if user else []
 
+    render_mode = render_mode or RENDER_MODE
+    if render_mode not in RENDER_MODES:
+        raise HTTPException(status_code=400, detail=f"render_mode must be one of {', '.join(RENDER_MODES)}")
+
     # permissions
     if size == "m" and "admin" not in groups:
         return {"error": "invalid permissions"}
@@ -88,27 +398,52 @@ async def generate_julia(
         return {"error": "invalid permissions"}
 
     time_key = datetime.utcnow().strftime("%Y-%m-%d-%H-%M")
-    file_name = f"{country.lower()}_{city.lower()}_{size.lower()}_{time_key}.png"
+    # a subdivide render may differ from the full one, so it gets its own
+    # file, pending marker and cache entry
+    mode_part = "" if render_mode == "full" else f"_{render_mode}"
+    file_name = f"{country.lower()}_{city.lower()}_{size.lower()}{mode_part}_{time_key}{IMAGE_EXTENSION}"
 
     # check cache first
-    if await check_cache(file_name):
+    with metrics.stage("check_cache"):
+        cached = await check_cache(file_name)
+    if cached:
         url = await get_presigned_url(file_name)
         return {"status": "cached", "url": url}
 
-    # queue compute task
+    # someone else already queued this file
+    with metrics.stage("mark_pending"):
+        acquired = await mark_pending(file_name)
+    if not acquired:
+        return {
+            "status": "pending",
+            "file_name": file_name,
+            "message": f"julia compute task already queued for {file_name}. retrieve image at: /get/{file_name}"
+        }
+
+    # queue compute task on the lane for its cost
+    cost = job_cost(size)
+    lane = job_lane(cost)
     task = {
         "action": "create_julia_image",
         "country": country,
         "city": city,
         "size": size,
         "file_name": file_name,
+        "lane": lane,
+        "cost": cost,
+        "render_mode": render_mode,
+        "image_format": IMAGE_FORMAT,
+        "trace_id": metrics.trace_id.get(),
         "requested_at": datetime.utcnow().isoformat()
     }
 
-    sqs.send_message(
-        QueueUrl=SQS_QUEUE_URL,
-        MessageBody=json.dumps(task)
-    )
+    try:
+        with metrics.stage("enqueue"):
+            await enqueue(LANE_QUEUE_URLS[lane], task)
+    except Exception as e:
+        print(f"failed to queue {file_name}: {e}")
+        await clear_pending(file_name)
+        raise HTTPException(status_code=503, detail="failed to queue compute task")
 
     return {
         "status": "queued",
@@ -117,48 +452,69 @@ async def generate_julia(
     }
 
 
+@app.get("/queues")
+async def queue_depths():
+    # per lane backlog; lanes sharing a queue report the same numbers
+    async def depth(queue_url):
+        res = await asyncio.to_thread(lambda: get_sqs().get_queue_attributes(
+            QueueUrl=queue_url,
+            AttributeNames=["ApproximateNumberOfMessages", "ApproximateNumberOfMessagesNotVisible"]
+        ))
+        attrs = res.get("Attributes", {})
+        return {
+            "waiting": int(attrs.get("ApproximateNumberOfMessages", 0)),
+            "in_flight": int(attrs.get("ApproximateNumberOfMessagesNotVisible", 0)),
+        }
+
+    try:
+        results = await asyncio.gather(*(depth(LANE_QUEUE_URLS[name]) for name, _ in LANES))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return {name: result for (name, _), result in zip(LANES, results)}
+
+
 @app.post("/login")
 async def login(request: Request):
     data = await request.json()
-    async with httpx.AsyncClient() as client:
-        try:
-            res = await client.post(f"{AUTH_SERVICE_URL}/login", json=data)
-            res.raise_for_status()
-            return res.json()
-        except httpx.HTTPStatusError as e:
-            raise HTTPException(status_code=e.response.status_code,
-                                detail=e.response.text)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=str(e))
+    client = get_http_client()
+    try:
+        res = await client.post(f"{AUTH_SERVICE_URL}/login", json=data)
+        res.raise_for_status()
+        return res.json()
+    except httpx.HTTPStatusError as e:
+        raise HTTPException(status_code=e.response.status_code,
+                            detail=e.response.text)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/signup")
 async def signup(request: Request):
     data = await request.json()
-    async with httpx.AsyncClient() as client:
-        try:
-            res = await client.post(f"{AUTH_SERVICE_URL}/signup", json=data)
-            res.raise_for_status()
-            return res.json()
-        except httpx.HTTPStatusError as e:
-            raise HTTPException(status_code=e.response.status_code,
-                                detail=e.response.text)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=str(e))
+    client = get_http_client()
+    try:
+        res = await client.post(f"{AUTH_SERVICE_URL}/signup", json=data)
+        res.raise_for_status()
+        return res.json()
+    except httpx.HTTPStatusError as e:
+        raise HTTPException(status_code=e.response.status_code,
+                            detail=e.response.text)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/confirm")
 async def confirm(request: Request):
     data = await request.json()
-    async with httpx.AsyncClient() as client:
-        try:
-            res = await client.post(f"{AUTH_SERVICE_URL}/confirm", json=data)
-            res.raise_for_status()
-            return res.json()
-        except httpx.HTTPStatusError as e:
-            raise HTTPException(status_code=e.response.status_code,
-                                detail=e.response.text)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=str(e))
+    client = get_http_client()
+    try:
+        res = await client.post(f"{AUTH_SERVICE_URL}/confirm", json=data)
+        res.raise_for_status()
+        return res.json()
+    except httpx.HTTPStatusError as e:
+        raise HTTPException(status_code=e.response.status_code,
+                            detail=e.response.text)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
         
         
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# common/ is copied next to the service's modules in the image; run from the
+# service dir (python -m benchmarks.x) it has to be put on the path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "common"))
@@ -0,0 +1,107 @@
+# /generate latency on the cached path against a local stand-in data-service,
+# with a fresh httpx client per hop (the old behaviour) vs. the shared pool
+#   python -m benchmarks.cached_generate [--requests 500] [--concurrency 10]
+import os
+import time
+import socket
+import asyncio
+import argparse
+import threading
+import statistics
+
+import httpx
+import uvicorn
+from fastapi import FastAPI
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_data_service(port):
+    stand_in = FastAPI()
+
+    @stand_in.get("/cache/{filename}")
+    def check_cache(filename: str):
+        return {"exists": True}
+
+    @stand_in.get("/s3/url/{key}")
+    def get_presigned_url(key: str):
+        return {"url": f"https://bucket.example/{key}?X-Amz-Signature=stand-in"}
+
+    server = uvicorn.Server(uvicorn.Config(stand_in, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def per_call_check_cache(filename):
+    async with httpx.AsyncClient() as client:
+        res = await client.get(f"{api_gateway.DATA_SERVICE_URL}/cache/{filename}")
+        res.raise_for_status()
+        return res.json().get("exists", False)
+
+
+async def per_call_presigned_url(key):
+    async with httpx.AsyncClient() as client:
+        res = await client.get(f"{api_gateway.DATA_SERVICE_URL}/s3/url/{key}")
+        res.raise_for_status()
+        return res.json().get("url")
+
+
+async def drive(requests, concurrency):
+    latencies = []
+    sem = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=api_gateway.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://gateway") as gateway:
+        async def one(i):
+            async with sem:
+                start = time.perf_counter()
+                res = await gateway.get("/generate", params={"country": "Australia", "city": f"City{i % 50}", "size": "l"})
+                latencies.append(time.perf_counter() - start)
+                assert res.json()["status"] == "cached", res.text
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(requests)))
+        elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "rps": requests / elapsed,
+        "p50_ms": 1000 * statistics.median(latencies),
+        "p99_ms": 1000 * latencies[int(0.99 * (len(latencies) - 1))],
+    }
+
+
+async def main(args):
+    pooled_check, pooled_url = api_gateway.check_cache, api_gateway.get_presigned_url
+
+    api_gateway.check_cache, api_gateway.get_presigned_url = per_call_check_cache, per_call_presigned_url
+    await drive(20, args.concurrency)
+    before = await drive(args.requests, args.concurrency)
+
+    api_gateway.check_cache, api_gateway.get_presigned_url = pooled_check, pooled_url
+    await drive(20, args.concurrency)
+    after = await drive(args.requests, args.concurrency)
+    await api_gateway.http_client.aclose()
+
+    print(f"{'client':<10} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, r in (("per-call", before), ("pooled", after)):
+        print(f"{name:<10} {r['rps']:>8.0f} {r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+
+    port = free_port()
+    os.environ["DATA_SERVICE_URL"] = f"http://127.0.0.1:{port}"
+    os.environ.setdefault("AWS_REGION", "ap-southeast-2")
+    import api_gateway
+
+    start_data_service(port)
+    asyncio.run(main(args))
@@ -0,0 +1,121 @@
+# /generate throughput on the queueing path against a local stand-in
+# data-service and a fake SQS with a fixed round trip: a blocking
+# send_message per request (the old behaviour) vs. the micro-batched enqueue
+#   python -m benchmarks.enqueue_load [--requests 1000] [--concurrency 50] [--latency-ms 20]
+import os
+import time
+import asyncio
+import argparse
+import itertools
+import threading
+import statistics
+
+import httpx
+import uvicorn
+from fastapi import FastAPI
+
+from benchmarks.cached_generate import free_port
+
+
+def start_data_service(port):
+    stand_in = FastAPI()
+
+    @stand_in.get("/cache/{filename}")
+    def check_cache(filename: str):
+        return {"exists": False}
+
+    @stand_in.post("/cache/{filename}/pending")
+    def mark_pending(filename: str):
+        return {"acquired": True}
+
+    server = uvicorn.Server(uvicorn.Config(stand_in, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+class FakeSqs:
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+        self.messages = 0
+        self._ids = itertools.count()
+
+    def send_message(self, QueueUrl, MessageBody):
+        time.sleep(self.latency)
+        self.calls += 1
+        self.messages += 1
+        return {"MessageId": str(next(self._ids))}
+
+    def send_message_batch(self, QueueUrl, Entries):
+        time.sleep(self.latency)
+        self.calls += 1
+        self.messages += len(Entries)
+        return {"Successful": [{"Id": e["Id"], "MessageId": str(next(self._ids))} for e in Entries]}
+
+
+async def blocking_enqueue(queue_url, task):
+    api_gateway.get_sqs().send_message(QueueUrl=queue_url, MessageBody=api_gateway.json.dumps(task))
+
+
+async def drive(requests, concurrency, offset):
+    latencies = []
+    sem = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=api_gateway.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://gateway") as gateway:
+        async def one(i):
+            async with sem:
+                start = time.perf_counter()
+                res = await gateway.get("/generate", params={"country": "Australia", "city": f"City{offset + i}", "size": "l"})
+                latencies.append(time.perf_counter() - start)
+                assert res.json()["status"] == "queued", res.text
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(requests)))
+        elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "rps": requests / elapsed,
+        "p50_ms": 1000 * statistics.median(latencies),
+        "p99_ms": 1000 * latencies[int(0.99 * (len(latencies) - 1))],
+    }
+
+
+async def main(args):
+    results = {}
+    batched_enqueue = api_gateway.enqueue
+    for name, enqueue in (("blocking", blocking_enqueue), ("batched", batched_enqueue)):
+        sqs = FakeSqs(args.latency_ms / 1000)
+        api_gateway.get_sqs = api_gateway.sqs_batcher.get_sqs = lambda: sqs
+        api_gateway.enqueue = enqueue
+        api_gateway.sqs_batcher.start()
+        await drive(20, args.concurrency, 0)
+        sqs.calls = sqs.messages = 0
+        results[name] = await drive(args.requests, args.concurrency, 20)
+        await api_gateway.sqs_batcher.close()
+        results[name]["calls"] = sqs.calls
+        assert sqs.messages == args.requests, sqs.messages
+    await api_gateway.http_client.aclose()
+
+    print(f"{'enqueue':<10} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'sqs calls':>10}")
+    for name, r in results.items():
+        print(f"{name:<10} {r['rps']:>8.0f} {r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f} {r['calls']:>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    args = parser.parse_args()
+
+    port = free_port()
+    os.environ["DATA_SERVICE_URL"] = f"http://127.0.0.1:{port}"
+    os.environ.setdefault("AWS_REGION", "ap-southeast-2")
+    for lane in ("SMALL", "MEDIUM", "LARGE"):
+        os.environ.setdefault(f"SQS_QUEUE_URL_{lane}", f"https://sqs.example/{lane.lower()}")
+    import api_gateway
+
+    start_data_service(port)
+    asyncio.run(main(args))
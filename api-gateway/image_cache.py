@@ -0,0 +1,87 @@
+import re
+from collections import OrderedDict, namedtuple
+
+from fastapi.responses import Response
+
+cached_image = namedtuple("cached_image", ["content", "etag", "media_type"])
+
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class ImageLRU:
+    # least recently used images, evicted by total size in bytes
+    def __init__(self, max_bytes: int, max_item_bytes: int):
+        self.max_bytes = max_bytes
+        self.max_item_bytes = min(max_item_bytes, max_bytes)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+
+    @property
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "bytes": self.size, "items": len(self._items)}
+
+    def get(self, key: str):
+        item = self._items.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return item
+
+    def put(self, key: str, item: cached_image):
+        if len(item.content) > self.max_item_bytes:
+            return
+        old = self._items.pop(key, None)
+        if old is not None:
+            self.size -= len(old.content)
+        self._items[key] = item
+        self.size += len(item.content)
+        while self.size > self.max_bytes:
+            _, evicted = self._items.popitem(last=False)
+            self.size -= len(evicted.content)
+
+
+def parse_range(header: str, length: int):
+    # single "bytes=a-b" range -> (start, end) inclusive; None means serve the
+    # whole body, ValueError means unsatisfiable
+    match = _RANGE.match(header.strip()) if header else None
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first == "":
+        start, end = max(0, length - int(last)), length - 1
+    else:
+        start = int(first)
+        end = min(int(last), length - 1) if last else length - 1
+    if start >= length or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def image_response(item: cached_image, if_none_match: str, range_header: str, cache_control: str):
+    headers = {"Cache-Control": cache_control, "Accept-Ranges": "bytes"}
+    if item.etag:
+        headers["ETag"] = item.etag
+        if if_none_match and item.etag in [t.strip() for t in if_none_match.split(",")]:
+            return Response(status_code=304, headers=headers)
+
+    length = len(item.content)
+    try:
+        byte_range = parse_range(range_header, length)
+    except ValueError:
+        headers["Content-Range"] = f"bytes */{length}"
+        return Response(status_code=416, headers=headers)
+    if byte_range is None:
+        return Response(content=item.content, media_type=item.media_type, headers=headers)
+
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{length}"
+    return Response(
+        content=item.content[start:end + 1],
+        status_code=206,
+        media_type=item.media_type,
+        headers=headers,
+    )
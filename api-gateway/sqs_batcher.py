@@ -0,0 +1,105 @@
+import asyncio
+import itertools
+
+
+class SqsBatcher:
+    # buffers messages for up to `linger` seconds and sends them with
+    # send_message_batch (10 per call, up to `max_in_flight` calls at once).
+    # send() waits until its message is accepted by SQS; the bounded buffer
+    # makes callers wait when SQS falls behind. failed entries are retried
+    # with backoff and close() flushes whatever is still buffered. get_sqs
+    # returns the boto3 client, built on first use
+    def __init__(self, get_sqs, max_buffer=1000, linger=0.005, max_in_flight=8, max_retries=3):
+        self.get_sqs = get_sqs
+        self.linger = linger
+        self.max_retries = max_retries
+        self.stats = {"messages": 0, "batches": 0, "retries": 0, "failed": 0}
+        self._buffer = asyncio.Queue(maxsize=max_buffer)
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._in_flight = set()
+        self._flusher = None
+        self._ids = itertools.count()
+
+    def start(self):
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.ensure_future(self._flush_loop())
+
+    async def close(self):
+        if self._flusher is None:
+            return
+        await self._buffer.join()
+        self._flusher.cancel()
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+        self._flusher = None
+
+    async def send(self, queue_url: str, body: str):
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._buffer.put((queue_url, body, future))
+        return await future
+
+    async def _flush_loop(self):
+        while True:
+            batch = [await self._buffer.get()]
+            deadline = asyncio.get_running_loop().time() + self.linger
+            while len(batch) < 10:
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._buffer.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            by_queue = {}
+            for item in batch:
+                by_queue.setdefault(item[0], []).append(item)
+            for queue_url, items in by_queue.items():
+                await self._slots.acquire()
+                task = asyncio.ensure_future(self._send_batch(queue_url, items))
+                self._in_flight.add(task)
+                task.add_done_callback(self._in_flight.discard)
+
+    async def _send_batch(self, queue_url, items):
+        pending = {str(next(self._ids)): item for item in items}
+        error = RuntimeError("send_message_batch failed")
+        try:
+            for attempt in range(self.max_retries + 1):
+                if attempt:
+                    self.stats["retries"] += len(pending)
+                    await asyncio.sleep(0.05 * 2 ** attempt)
+                entries = [{"Id": id_, "MessageBody": item[1]} for id_, item in pending.items()]
+                try:
+                    res = await asyncio.to_thread(
+                        lambda: self.get_sqs().send_message_batch(QueueUrl=queue_url, Entries=entries)
+                    )
+                except Exception as e:
+                    error = e
+                    continue
+                self.stats["batches"] += 1
+
+                for ok in res.get("Successful", []):
+                    item = pending.pop(ok["Id"])
+                    self.stats["messages"] += 1
+                    if not item[2].done():
+                        item[2].set_result(ok.get("MessageId"))
+                for failed in res.get("Failed", []):
+                    error = RuntimeError(f"{failed.get('Code')}: {failed.get('Message')}")
+                    # sender faults (bad message) won't succeed on retry
+                    if failed.get("SenderFault"):
+                        self._fail(pending.pop(failed["Id"]), error)
+                if not pending:
+                    return
+
+            for item in pending.values():
+                self._fail(item, error)
+        finally:
+            for _ in items:
+                self._buffer.task_done()
+            self._slots.release()
+
+    def _fail(self, item, error):
+        self.stats["failed"] += 1
+        if not item[2].done():
+            item[2].set_exception(error)
@@ -0,0 +1,63 @@
+import asyncio
+
+
+class TileBatcher:
+    # tile misses for the same group (constant, z, palette) that arrive within
+    # `linger` seconds go to the renderer as one batch; a tile that is already
+    # waiting or being rendered is shared by everyone asking for it.
+    # render(group, tiles) must return {tile: bytes}
+    def __init__(self, render, linger=0.01, max_batch=64):
+        self.render = render
+        self.linger = linger
+        self.max_batch = max_batch
+        self.stats = {"tiles": 0, "batches": 0, "shared": 0}
+        self._waiting = {}
+        self._in_flight = {}
+        self._timers = {}
+        self._tasks = set()
+
+    async def get(self, group, tile):
+        batch = self._waiting.setdefault(group, {})
+        future = self._in_flight.get((group, tile)) or batch.get(tile)
+        if future is not None:
+            self.stats["shared"] += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        batch[tile] = future
+        if len(batch) >= self.max_batch:
+            self._flush(group)
+        elif group not in self._timers:
+            self._timers[group] = asyncio.get_running_loop().call_later(self.linger, self._flush, group)
+        return await asyncio.shield(future)
+
+    def _flush(self, group):
+        timer = self._timers.pop(group, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._waiting.pop(group, None)
+        if not batch:
+            return
+        for tile, future in batch.items():
+            self._in_flight[(group, tile)] = future
+        task = asyncio.ensure_future(self._run(group, batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, group, batch):
+        self.stats["batches"] += 1
+        self.stats["tiles"] += len(batch)
+        try:
+            rendered = await self.render(group, list(batch))
+            for tile, future in batch.items():
+                if tile in rendered:
+                    future.set_result(rendered[tile])
+                else:
+                    future.set_exception(RuntimeError(f"tile {tile} missing from render"))
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            for tile in batch:
+                self._in_flight.pop((group, tile), None)
@@ -0,0 +1,84 @@
+import time
+import asyncio
+from collections import OrderedDict
+
+from jose import jwt
+
+
+class UnknownKeyError(Exception):
+    pass
+
+
+class TokenVerifier:
+    # verifies RS256 tokens against a JWKS cached by kid; verified claims are
+    # kept per token until the token's exp. an unknown kid triggers a
+    # (rate limited) background JWKS refresh and raises UnknownKeyError so the
+    # caller can fall back to auth-service
+    def __init__(self, get_client, jwks_url: str, audience: str, cache_size=10000, min_refresh_interval=60.0):
+        self.get_client = get_client
+        self.jwks_url = jwks_url
+        self.audience = audience
+        self.cache_size = cache_size
+        self.min_refresh_interval = min_refresh_interval
+        self.keys = {}
+        self.hits = 0
+        self.misses = 0
+        self._claims = OrderedDict()
+        self._last_refresh = 0.0
+        self._refreshing = None
+
+    async def refresh(self):
+        self._last_refresh = time.monotonic()
+        res = await self.get_client().get(self.jwks_url)
+        res.raise_for_status()
+        self.keys = {key["kid"]: key for key in res.json().get("keys", [])}
+
+    def refresh_in_background(self):
+        if self._refreshing is not None and not self._refreshing.done():
+            return
+        if time.monotonic() - self._last_refresh < self.min_refresh_interval:
+            return
+        self._refreshing = asyncio.ensure_future(self.try_refresh())
+
+    async def try_refresh(self):
+        try:
+            await self.refresh()
+        except Exception as e:
+            print(f"failed to refresh JWKS: {e}")
+
+    def _cached(self, token: str):
+        claims = self._claims.get(token)
+        if claims is None:
+            return None
+        if claims.get("exp", 0) <= time.time():
+            del self._claims[token]
+            return None
+        self._claims.move_to_end(token)
+        return claims
+
+    def remember(self, token: str, claims: dict):
+        if "exp" not in claims:
+            return
+        self._claims[token] = claims
+        self._claims.move_to_end(token)
+        while len(self._claims) > self.cache_size:
+            self._claims.popitem(last=False)
+
+    def verify(self, token: str):
+        # raises jwt.JWTError for invalid tokens, UnknownKeyError if the
+        # signing key isn't in the cached JWKS
+        claims = self._cached(token)
+        if claims is not None:
+            self.hits += 1
+            return claims
+        self.misses += 1
+
+        kid = jwt.get_unverified_header(token).get("kid")
+        key = self.keys.get(kid)
+        if key is None:
+            self.refresh_in_background()
+            raise UnknownKeyError(kid)
+
+        claims = jwt.decode(token, key, algorithms=["RS256"], audience=self.audience)
+        self.remember(token, claims)
+        return claims
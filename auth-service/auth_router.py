@@ -1,7 +1,18 @@
 from fastapi import FastAPI, Request, HTTPException
 from . import auth_service
+# common/, not part of this package
+import metrics
+from startup import Warmup, health_routes
 
-app = FastAPI()
+warmup = Warmup({
+    "cognito": auth_service.get_cognito,
+    "jwks": auth_service.get_jwks,
+    "client_secret": auth_service.client_secret_cache.get,
+})
+app = FastAPI(lifespan=warmup.lifespan)
+metrics.instrument(app, "auth-service")
+health_routes(app, warmup)
+metrics.register_stats("secret_cache", lambda: auth_service.client_secret_cache.stats)
 
 @app.post("/verify-token")
 async def verify_token(request: Request):
@@ -10,6 +21,13 @@ async def verify_token(request: Request):
     claims = auth_service.authenticate_token_from_string(token)
     return claims
 
+@app.get("/stats/secret-cache")
+def secret_cache_stats():
+    return {
+        **auth_service.client_secret_cache.stats,
+        "secret_hash_cache": auth_service.compute_secret_hash.cache_info()._asdict(),
+    }
+
 @app.post("/signup")
 async def signup(request: Request):
     data = await request.json()
@@ -3,43 +3,66 @@ import json
 import hmac
 import hashlib
 import base64
+from functools import lru_cache
 import requests
 from fastapi import HTTPException
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-import boto3
-from botocore.exceptions import ClientError
 from jose import jwt
+from .secret_cache import SecretCache
+from startup import aws_client, once  # common/, not part of this package
 
 AWS_REGION = os.getenv("AWS_REGION")
 CLIENT_ID = os.getenv("COGNITO_CLIENT_ID")
+CLIENT_SECRET_TTL = float(os.getenv("CLIENT_SECRET_TTL", "300"))
+JWKS_TIMEOUT = float(os.getenv("JWKS_TIMEOUT", "10"))
 
-cognito_client = boto3.client("cognito-idp", region_name=AWS_REGION)
-secrets_client = boto3.client("secretsmanager", region_name=AWS_REGION)
-ssm_client = boto3.client("ssm", region_name=AWS_REGION)
+security = HTTPBearer()
 
-jwks_url_response = ssm_client.get_parameter(
-    Name="/n10807144-a2/jwks-url",
-    WithDecryption=True
-)
-JWKS_URL = jwks_url_response["Parameter"]["Value"]
-JWKS = requests.get(JWKS_URL).json()
 
-security = HTTPBearer()
+@once
+def get_cognito():
+    return aws_client("cognito-idp", region_name=AWS_REGION)
+
+
+@once
+def get_secrets():
+    return aws_client("secretsmanager", region_name=AWS_REGION)
+
+
+@once
+def get_ssm():
+    return aws_client("ssm", region_name=AWS_REGION)
+
+
+@once
+def get_jwks():
+    jwks_url = get_ssm().get_parameter(Name="/n10807144-a2/jwks-url", WithDecryption=True)["Parameter"]["Value"]
+    res = requests.get(jwks_url, timeout=JWKS_TIMEOUT)
+    res.raise_for_status()
+    return res.json()
+
 
 def get_public_key(token: str):
     headers = jwt.get_unverified_header(token)
     kid = headers["kid"]
-    key = next((k for k in JWKS["keys"] if k["kid"] == kid), None)
+    key = next((k for k in get_jwks()["keys"] if k["kid"] == kid), None)
     if not key:
         raise HTTPException(status_code=401, detail="Public key not found in JWKS")
     return key
 
 
-def get_secret_hash(username: str) -> str:
-    message = username + CLIENT_ID
-    secret_res = secrets_client.get_secret_value(SecretId="JULIA_CLIENT_SECRET")
+def fetch_client_secret() -> str:
+    secret_res = get_secrets().get_secret_value(SecretId="JULIA_CLIENT_SECRET")
     secret_string = secret_res["SecretString"]
-    client_secret = json.loads(secret_string)["COGNITO_CLIENT_SECRET"]
+    return json.loads(secret_string)["COGNITO_CLIENT_SECRET"]
+
+
+client_secret_cache = SecretCache(fetch_client_secret, ttl=CLIENT_SECRET_TTL)
+
+
+@lru_cache(maxsize=4096)
+def compute_secret_hash(client_secret: str, username: str) -> str:
+    message = username + CLIENT_ID
     dig = hmac.new(
         client_secret.encode("utf-8"),
         msg=message.encode("utf-8"),
@@ -48,6 +71,22 @@ def get_secret_hash(username: str) -> str:
     return base64.b64encode(dig).decode()
 
 
+def get_secret_hash(username: str) -> str:
+    # keyed on the secret itself, so a rotated secret never reuses old digests
+    return compute_secret_hash(client_secret_cache.get(), username)
+
+
+def with_secret_retry(call):
+    # a rotated client secret shows up as a secret hash mismatch: reload once
+    try:
+        return call()
+    except get_cognito().exceptions.NotAuthorizedException as e:
+        if "secret hash" not in str(e).lower():
+            raise
+        client_secret_cache.invalidate()
+        return call()
+
+
 def authenticate_token(credentials: HTTPAuthorizationCredentials):
     if not credentials or credentials.scheme != "Bearer":
         raise HTTPException(status_code=401, detail="Unauthorized")
@@ -73,27 +112,27 @@ def authenticate_token_from_string(token: str):
     return authenticate_token(Credentials())
 
 def cognito_signup(username: str, password: str, email: str):
-    return cognito_client.sign_up(
+    return with_secret_retry(lambda: get_cognito().sign_up(
         ClientId=CLIENT_ID,
         SecretHash=get_secret_hash(username),
         Username=username,
         Password=password,
         UserAttributes=[{"Name": "email", "Value": email}],
-    )
+    ))
 
 
 def cognito_confirm(username: str, code: str):
-    return cognito_client.confirm_sign_up(
+    return with_secret_retry(lambda: get_cognito().confirm_sign_up(
         ClientId=CLIENT_ID,
         SecretHash=get_secret_hash(username),
         Username=username,
         ConfirmationCode=code,
-    )
+    ))
 
 
 def cognito_login(username: str, password: str = None, mfa_code: str = None, session: str = None):
     if mfa_code and session:
-        return cognito_client.respond_to_auth_challenge(
+        return with_secret_retry(lambda: get_cognito().respond_to_auth_challenge(
             ClientId=CLIENT_ID,
             ChallengeName="EMAIL_OTP",
             Session=session,
@@ -102,11 +141,11 @@ def cognito_login(username: str, password: str = None, mfa_code: str = None, ses
                 "EMAIL_OTP_CODE": mfa_code,
                 "SECRET_HASH": get_secret_hash(username)
             }
-        )
+        ))
     else:
         if not password:
             raise HTTPException(status_code=400, detail="Password is required for first step")
-        return cognito_client.initiate_auth(
+        return with_secret_retry(lambda: get_cognito().initiate_auth(
             AuthFlow="USER_PASSWORD_AUTH",
             AuthParameters={
                 "USERNAME": username,
@@ -114,4 +153,4 @@ def cognito_login(username: str, password: str = None, mfa_code: str = None, ses
                 "SECRET_HASH": get_secret_hash(username),
             },
             ClientId=CLIENT_ID
-        )
+        ))
@@ -0,0 +1,74 @@
+import time
+import logging
+import threading
+
+logger = logging.getLogger("auth-service")
+
+
+class SecretCache:
+    # caches a secret for `ttl` seconds. the first load blocks; after that an
+    # expired value is still returned while a background thread refreshes it,
+    # and if the refresh fails the stale value keeps being served (retried
+    # after `retry_interval`). invalidate() forces a blocking reload, e.g.
+    # after the secret was rotated
+    def __init__(self, fetch, ttl=300.0, retry_interval=10.0):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.retry_interval = retry_interval
+        self.stats = {
+            "hits": 0,
+            "stale_hits": 0,
+            "loads": 0,
+            "refreshes": 0,
+            "refresh_failures": 0,
+            "last_refresh_seconds": 0.0,
+            "max_refresh_seconds": 0.0,
+        }
+        self._value = None
+        self._expires_at = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._value is None:
+                self.stats["loads"] += 1
+                self._value = self._load()
+                return self._value
+
+            if time.monotonic() < self._expires_at:
+                self.stats["hits"] += 1
+            else:
+                self.stats["stale_hits"] += 1
+                if not self._refreshing:
+                    self._refreshing = True
+                    threading.Thread(target=self._refresh, daemon=True).start()
+            return self._value
+
+    def invalidate(self):
+        with self._lock:
+            self._value = None
+
+    def _load(self):
+        start = time.monotonic()
+        value = self.fetch()
+        elapsed = time.monotonic() - start
+        self._expires_at = time.monotonic() + self.ttl
+        self.stats["refreshes"] += 1
+        self.stats["last_refresh_seconds"] = elapsed
+        self.stats["max_refresh_seconds"] = max(self.stats["max_refresh_seconds"], elapsed)
+        return value
+
+    def _refresh(self):
+        try:
+            value = self._load()
+            with self._lock:
+                self._value = value
+        except Exception as e:
+            logger.warning(f"secret refresh failed, serving stale value: {e}")
+            with self._lock:
+                self.stats["refresh_failures"] += 1
+                self._expires_at = time.monotonic() + self.retry_interval
+        finally:
+            with self._lock:
+                self._refreshing = False
@@ -0,0 +1,23 @@
+# output format of rendered frames, read by the gateway to name the file it
+# hands out and by the compute worker to encode it, so the two can't disagree:
+# "png" (24-bit RGB), "png8" (palette indexed, same pixels when the palette
+# has <= 256 colors) or "webp"
+import os
+from collections import namedtuple
+
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "png")
+
+image_format = namedtuple("image_format", ["extension", "content_type"])
+
+FORMATS = {
+    "png": image_format(".png", "image/png"),
+    "png8": image_format(".png", "image/png"),
+    "webp": image_format(".webp", "image/webp"),
+}
+
+
+def get_format(name=None):
+    name = name or IMAGE_FORMAT
+    if name not in FORMATS:
+        raise ValueError(f"unknown image format: {name}")
+    return FORMATS[name]
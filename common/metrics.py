@@ -0,0 +1,245 @@
+import os
+import json
+import time
+import uuid
+import random
+import logging
+import cProfile
+import threading
+import contextvars
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# process-local counters and histograms in the Prometheus text format, and the
+# trace id of the request or job being handled. shared by every service: the
+# Dockerfiles copy common/ next to the service's modules, and local runs put
+# common/ on PYTHONPATH
+
+TRACE_HEADER = "X-Trace-Id"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# fraction of maybe_profile() blocks run under cProfile, dumped to PROFILE_DIR
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/profiles")
+
+trace_id = contextvars.ContextVar("trace_id", default=None)
+
+_lock = threading.Lock()
+_profiling = threading.Lock()
+_metrics = {}
+_collectors = []
+
+
+def _format_value(v):
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return str(v)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = []
+    for k, v in labels:
+        v = str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{k}="{v}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield self.name, key, value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        for key, (counts, total, count) in self.values.items():
+            for bound, n in zip(self.buckets, counts):
+                yield f"{self.name}_bucket", key + (("le", _format_value(float(bound))),), n
+            yield f"{self.name}_bucket", key + (("le", "+Inf"),), count
+            yield f"{self.name}_sum", key, total
+            yield f"{self.name}_count", key, count
+
+
+def _register(cls, name, *args):
+    with _lock:
+        if name not in _metrics:
+            _metrics[name] = cls(name, *args)
+        return _metrics[name]
+
+
+def counter(name, help):
+    return _register(Counter, name, help)
+
+
+def histogram(name, help, buckets=DEFAULT_BUCKETS):
+    return _register(Histogram, name, help, buckets)
+
+
+def register_stats(prefix, get_stats):
+    # exports the numeric values of an existing stats dict as gauges
+    _collectors.append((prefix, get_stats))
+
+
+stage_seconds = histogram("stage_duration_seconds", "Time spent in each pipeline stage")
+
+
+def stage(name):
+    # with metrics.stage("upload"): ...
+    return stage_seconds.time(stage=name)
+
+
+def render():
+    lines = []
+    with _lock:
+        for metric in _metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    for prefix, get_stats in _collectors:
+        for key, value in get_stats().items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append(f"# TYPE {prefix}_{key} gauge")
+                lines.append(f"{prefix}_{key} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def new_trace_id():
+    return uuid.uuid4().hex
+
+
+class TraceLogFilter(logging.Filter):
+    # adds %(trace_id)s to log records; attach to handlers
+    def filter(self, record):
+        record.trace_id = trace_id.get() or "-"
+        return True
+
+
+async def add_trace_header(request):
+    # httpx request hook: outgoing calls carry the current trace id
+    current = trace_id.get()
+    if current and TRACE_HEADER not in request.headers:
+        request.headers[TRACE_HEADER] = current
+
+
+def instrument(app, service):
+    # request duration histogram, trace id handling and GET /metrics
+    from fastapi.responses import Response
+
+    requests = histogram("http_request_duration_seconds", "HTTP request latency by route")
+
+    @app.middleware("http")
+    async def observe_request(request, call_next):
+        token = trace_id.set(request.headers.get(TRACE_HEADER) or new_trace_id())
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            response.headers[TRACE_HEADER] = trace_id.get()
+            return response
+        finally:
+            route = getattr(request.scope.get("route"), "path", "unmatched")
+            requests.observe(
+                time.perf_counter() - start,
+                service=service, method=request.method, route=route, status=status,
+            )
+            trace_id.reset(token)
+
+    @app.get("/metrics", include_in_schema=False)
+    def metrics_endpoint():
+        return Response(render(), media_type="text/plain; version=0.0.4")
+
+
+def start_http_server(port, host="0.0.0.0", warmup=None):
+    # /metrics for processes without a web app (the SQS worker), plus
+    # /healthz and /readyz when given the process's startup.Warmup
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                self.reply(200, render(), "text/plain; version=0.0.4")
+            elif self.path == "/healthz" and warmup is not None:
+                self.reply(200, json.dumps({"status": "ok"}), "application/json")
+            elif self.path == "/readyz" and warmup is not None:
+                self.reply(200 if warmup.ready else 503, json.dumps(warmup.status()), "application/json")
+            else:
+                self.send_error(404)
+
+        def reply(self, status, text, content_type):
+            body = text.encode()
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@contextmanager
+def maybe_profile(name):
+    # runs a sample of blocks under cProfile (one at a time per process) and
+    # writes PROFILE_DIR/<name>-<trace id>.prof; only sees the calling thread
+    if PROFILE_SAMPLE_RATE <= 0 or random.random() >= PROFILE_SAMPLE_RATE or not _profiling.acquire(blocking=False):
+        yield
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            path = os.path.join(PROFILE_DIR, f"{name}-{trace_id.get() or new_trace_id()}.prof")
+            profiler.dump_stats(path)
+            print(f"wrote profile {path}")
+    finally:
+        _profiling.release()
@@ -0,0 +1,138 @@
+# lazy start-up: AWS clients, SSM parameters and JWKS are built on first use
+# instead of at import, so a process binds its port straight away. a Warmup
+# then builds them in parallel from the lifespan; /healthz answers as soon as
+# the process serves and /readyz only once every required step has succeeded.
+# shared by every service, like metrics.py
+import os
+import time
+import asyncio
+import threading
+from functools import wraps
+from contextlib import asynccontextmanager
+
+# background: serve at once, warm up alongside (readyz 503 until done)
+# blocking: warm up before accepting traffic
+# off: nothing is warmed, everything initializes on first use
+WARMUP_MODE = os.getenv("STARTUP_WARMUP", "background")
+WARMUP_RETRY_INTERVAL = float(os.getenv("STARTUP_RETRY_INTERVAL", "5"))
+
+_boto3_lock = threading.Lock()
+
+
+def once(fn):
+    # memoizes a no-argument initializer. concurrent first callers wait for
+    # the one build; a failure isn't remembered, the next call tries again
+    lock = threading.Lock()
+    missing = object()
+    value = missing
+
+    @wraps(fn)
+    def get():
+        nonlocal value
+        if value is missing:
+            with lock:
+                if value is missing:
+                    value = fn()
+        return value
+
+    return get
+
+
+def aws_client(name, **kwargs):
+    # boto3 is imported on first use; clients from its default session must
+    # not be created from several threads at once
+    import boto3
+
+    with _boto3_lock:
+        return boto3.client(name, **kwargs)
+
+
+def aws_resource(name, **kwargs):
+    import boto3
+
+    with _boto3_lock:
+        return boto3.resource(name, **kwargs)
+
+
+class Warmup:
+    # runs `steps` (name -> callable; plain ones in a thread, coroutine
+    # functions on the loop) concurrently, retrying failures every
+    # retry_interval. steps named in `optional` don't hold up readiness
+    def __init__(self, steps, optional=(), mode=WARMUP_MODE, retry_interval=WARMUP_RETRY_INTERVAL):
+        self.steps = steps
+        self.optional = set(optional)
+        self.mode = mode
+        self.retry_interval = retry_interval
+        self.state = {name: {"status": "pending", "seconds": None, "attempts": 0, "error": None} for name in steps}
+        self.seconds = None
+        self._task = None
+
+    @property
+    def ready(self):
+        if self.mode == "off":
+            return True
+        return all(s["status"] == "ok" for name, s in self.state.items() if name not in self.optional)
+
+    def status(self):
+        return {"ready": self.ready, "mode": self.mode, "seconds": self.seconds, "steps": self.state}
+
+    async def _step(self, name, fn):
+        state = self.state[name]
+        while True:
+            state["attempts"] += 1
+            start = time.perf_counter()
+            try:
+                if asyncio.iscoroutinefunction(fn):
+                    await fn()
+                else:
+                    await asyncio.to_thread(fn)
+            except Exception as e:
+                state.update(status="error", error=str(e), seconds=time.perf_counter() - start)
+                print(f"warm-up step {name} failed, retrying in {self.retry_interval}s: {e}")
+                await asyncio.sleep(self.retry_interval)
+                continue
+            state.update(status="ok", error=None, seconds=time.perf_counter() - start)
+            return
+
+    async def run(self):
+        start = time.perf_counter()
+        await asyncio.gather(*(self._step(name, fn) for name, fn in self.steps.items()))
+        self.seconds = time.perf_counter() - start
+        timings = ", ".join(f"{name} {s['seconds']:.3f}s" for name, s in self.state.items())
+        print(f"warm-up finished in {self.seconds:.3f}s ({timings})")
+
+    async def start(self):
+        if self.mode == "blocking":
+            await self.run()
+        elif self.mode == "background":
+            self._task = asyncio.ensure_future(self.run())
+
+    async def stop(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    @asynccontextmanager
+    async def lifespan(self, app=None):
+        await self.start()
+        try:
+            yield
+        finally:
+            await self.stop()
+
+
+def health_routes(app, warmup):
+    # liveness never touches dependencies; readiness reports the warm-up
+    from fastapi.responses import JSONResponse
+
+    @app.get("/healthz", include_in_schema=False)
+    async def healthz():
+        return {"status": "ok"}
+
+    @app.get("/readyz", include_in_schema=False)
+    async def readyz():
+        return JSONResponse(warmup.status(), status_code=200 if warmup.ready else 503)
@@ -0,0 +1,78 @@
+# flags regressions between two benchmarks.suite result files; exits 1 if
+# anything got slower (or bigger) by more than --threshold
+#   python -m benchmarks.compare baseline.json current.json [--threshold 0.1]
+import argparse
+import json
+import sys
+
+# (field, higher is better); timings below MIN_SECONDS are too noisy to judge
+KERNEL_FIELDS = [("pixels_per_second", True), ("iterate", False), ("colorize", False),
+                 ("encode", False), ("peak_bytes", False)]
+E2E_FIELDS = [("jobs_per_second", True), ("p50", False), ("p95", False)]
+MIN_SECONDS = 0.02
+
+
+def kernel_key(row):
+    return (row["size"], row["a"], row["b"], row.get("max_iter"))
+
+
+def check(label, field, old, new, higher_is_better, threshold):
+    if old is None or new is None or old == 0:
+        return None
+    if not field.endswith(("bytes", "per_second")) and max(old, new) < MIN_SECONDS:
+        return None
+    change = new / old - 1
+    worse = -change if higher_is_better else change
+    return {"what": f"{label} {field}", "old": old, "new": new, "change": change, "regression": worse > threshold}
+
+
+def compare(baseline, current, threshold=0.1):
+    rows = []
+    old_kernel = {kernel_key(r): r for r in baseline.get("kernel", [])}
+    for new in current.get("kernel", []):
+        old = old_kernel.get(kernel_key(new))
+        if old is None:
+            continue
+        label = f"{new['size']} c{new['constant']}"
+        for field, higher in KERNEL_FIELDS:
+            rows.append(check(label, field, old.get(field), new.get(field), higher, threshold))
+
+    old_e2e, new_e2e = baseline.get("e2e"), current.get("e2e")
+    if old_e2e and new_e2e:
+        for field, higher in E2E_FIELDS:
+            rows.append(check("e2e", field, old_e2e.get(field), new_e2e.get(field), higher, threshold))
+    return [r for r in rows if r is not None]
+
+
+def report(rows, baseline, current):
+    old_meta, new_meta = baseline.get("meta", {}), current.get("meta", {})
+    print(f"baseline {(old_meta.get('commit') or '?')[:12]} -> current {(new_meta.get('commit') or '?')[:12]}")
+    for field in ("mode", "format", "palette", "render_workers", "cpus"):
+        if old_meta.get(field) != new_meta.get(field):
+            print(f"warning: {field} differs ({old_meta.get(field)} vs {new_meta.get(field)})")
+    print(f"{'':<2}{'measurement':<34} {'baseline':>14} {'current':>14} {'change':>8}")
+    for r in rows:
+        flag = "!!" if r["regression"] else ""
+        print(f"{flag:<2}{r['what']:<34} {r['old']:>14.4g} {r['new']:>14.4g} {r['change']:>+7.1%}")
+    regressions = [r for r in rows if r["regression"]]
+    print(f"{len(regressions)} regression(s) out of {len(rows)} measurements")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative change counted as a regression")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    if report(compare(baseline, current, args.threshold), baseline, current):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
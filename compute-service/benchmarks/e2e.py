@@ -0,0 +1,280 @@
+# process_message end to end: jobs go through an in-memory SQS stand-in and
+# the real SqsConsumer, and compute_service talks HTTP to local stand-ins for
+# data-service and the time API. reports jobs/second, job latency and the
+# per-stage split from metrics.stage_seconds
+#   python -m benchmarks.e2e [--jobs 12] [--concurrency 4] [--sizes s,m] [--places 6] [--latency 0]
+import os
+import sys
+import json
+import time
+import queue
+import socket
+import asyncio
+import argparse
+import threading
+import contextlib
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request
+
+PLACES = [
+    ("Australia", "Brisbane"), ("Europe", "London"), ("America", "New_York"), ("Asia", "Tokyo"),
+    ("Europe", "Paris"), ("America", "Chicago"), ("Asia", "Singapore"), ("Africa", "Cairo"),
+    ("America", "Sao_Paulo"), ("Pacific", "Auckland"), ("Asia", "Kolkata"), ("Europe", "Berlin"),
+]
+QUEUE_URL = "standin://julia-jobs"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def serve(app, port):
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def data_service_stand_in(latency):
+    # the endpoints compute_service calls, over a dict instead of S3/memcached
+    app = FastAPI()
+    objects = {}
+
+    @app.get("/s3/exists/{key:path}")
+    async def image_exists(key: str):
+        await asyncio.sleep(latency)
+        return {"exists": key in objects}
+
+    @app.put("/s3/object/{key:path}")
+    async def upload_image_stream(key: str, request: Request):
+        body = bytearray()
+        async for chunk in request.stream():
+            body += chunk
+        await asyncio.sleep(latency)
+        objects[key] = bytes(body)
+        return {"message": "Image uploaded", "key": key, "bytes": len(body)}
+
+    @app.post("/s3/copy")
+    async def copy_image(req: dict):
+        await asyncio.sleep(latency)
+        if req["source_key"] not in objects:
+            raise HTTPException(status_code=404, detail=f"{req['source_key']} not found")
+        objects[req["key"]] = objects[req["source_key"]]
+        return {"message": "Image copied", "key": req["key"]}
+
+    @app.post("/cache/{filename}")
+    async def cache_file(filename: str):
+        await asyncio.sleep(latency)
+        return {"cached": True}
+
+    @app.delete("/cache/{filename}/pending")
+    async def clear_pending(filename: str):
+        return {"cleared": True}
+
+    @app.post("/db/put")
+    async def put_metadata(metadata: dict):
+        await asyncio.sleep(latency)
+        return {"message": "Metadata added", "file_name": metadata["file_name"]}
+
+    return app
+
+
+def time_api_stand_in(latency, date_format, time_format):
+    # same answers as the real API would give, so TimeLookup switches to local zones
+    app = FastAPI()
+
+    @app.get("/{zone:path}")
+    async def current_time(zone: str):
+        await asyncio.sleep(latency)
+        now = datetime.now(timezone.utc).astimezone(ZoneInfo(zone))
+        return {"date": now.strftime(date_format), "time": now.strftime(time_format)}
+
+    return app
+
+
+class StandInSQS:
+    # the calls SqsConsumer makes, over an in-memory queue
+    def __init__(self):
+        self.messages = queue.Queue()
+        self.in_flight = {}
+        self.deleted = 0
+        self.sent = 0
+
+    def send(self, body):
+        self.sent += 1
+        handle = f"handle-{self.sent}"
+        self.messages.put({
+            "MessageId": handle,
+            "ReceiptHandle": handle,
+            "Body": json.dumps(body),
+            "Attributes": {"SentTimestamp": str(int(time.time() * 1000))},
+        })
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages=1, WaitTimeSeconds=0, **kwargs):
+        received = []
+        try:
+            received.append(self.messages.get(timeout=max(WaitTimeSeconds, 0.01)))
+            while len(received) < MaxNumberOfMessages:
+                received.append(self.messages.get_nowait())
+        except queue.Empty:
+            pass
+        for msg in received:
+            self.in_flight[msg["ReceiptHandle"]] = msg
+        return {"Messages": received}
+
+    def delete_message_batch(self, QueueUrl, Entries):
+        for entry in Entries:
+            if self.in_flight.pop(entry["ReceiptHandle"], None) is not None:
+                self.deleted += 1
+        return {"Successful": [{"Id": e["Id"]} for e in Entries], "Failed": []}
+
+    def change_message_visibility(self, QueueUrl, ReceiptHandle, VisibilityTimeout):
+        pass
+
+    def change_message_visibility_batch(self, QueueUrl, Entries):
+        for entry in Entries:
+            msg = self.in_flight.pop(entry["ReceiptHandle"], None)
+            if msg is not None:
+                self.messages.put(msg)
+        return {"Successful": [{"Id": e["Id"]} for e in Entries], "Failed": []}
+
+
+def import_compute_service(data_url, time_url):
+    # compute_service reads its endpoints at import and the time API URL from
+    # SSM on first use, so point both at the stand-ins
+    os.environ["DATA_SERVICE_URL"] = data_url
+    os.environ["SQS_QUEUE_URL"] = QUEUE_URL
+    for name in ("SMALL", "MEDIUM", "LARGE"):
+        os.environ.pop(f"SQS_QUEUE_URL_{name}", None)
+    import compute_service
+    compute_service.get_external_api_url = lambda: time_url
+    return compute_service
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * (len(values) - 1) + 0.5))] if values else None
+
+
+async def drive(cs, sqs, tasks, concurrency):
+    from sqs_consumer import SqsConsumer
+
+    durations = []
+    failures = []
+    consumer = None
+
+    async def handler(task):
+        start = time.perf_counter()
+        try:
+            await cs.process_message(task)
+        except Exception as e:
+            failures.append(f"{task['file_name']}: {e}")
+            raise
+        finally:
+            durations.append(time.perf_counter() - start)
+            if len(durations) == len(tasks):
+                consumer.stop()
+
+    consumer = SqsConsumer(sqs, cs.get_lanes(), handler, concurrency=concurrency,
+                           wait_time=1, delete_interval=0.1)
+    cs.get_http_client()
+    start = time.perf_counter()
+    for task in tasks:
+        sqs.send(task)
+    try:
+        await consumer.run()
+    finally:
+        await cs.close_http_client()
+    return time.perf_counter() - start, durations, failures
+
+
+def run(jobs=12, concurrency=4, sizes=("s", "m"), places=6, latency=0.0):
+    date_format = os.getenv("TIME_DATE_FORMAT", "%m/%d/%Y")
+    time_format = os.getenv("TIME_TIME_FORMAT", "%H:%M")
+    data_port, time_port = free_port(), free_port()
+    servers = [
+        serve(data_service_stand_in(latency), data_port),
+        serve(time_api_stand_in(latency, date_format, time_format), time_port),
+    ]
+    cs = import_compute_service(f"http://127.0.0.1:{data_port}", f"http://127.0.0.1:{time_port}/")
+    import metrics
+    import render_cache
+
+    sqs = StandInSQS()
+    run_id = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
+    tasks = []
+    for i in range(jobs):
+        country, city = PLACES[i % min(places, len(PLACES))]
+        size = sizes[i % len(sizes)]
+        tasks.append({
+            "action": "create_julia_image",
+            "country": country,
+            "city": city,
+            "size": size,
+            "file_name": f"bench_{run_id}_{i}_{size}.png",
+            "trace_id": f"bench-{run_id}-{i}",
+        })
+
+    renders_before = dict(render_cache.stats)
+    # compute_service logs every job; keep stdout for the results
+    with contextlib.redirect_stdout(sys.stderr):
+        elapsed, durations, failures = asyncio.run(drive(cs, sqs, tasks, concurrency))
+    for server in servers:
+        server.should_exit = True
+
+    stages = {}
+    for labels, (_, total, count) in metrics.stage_seconds.values.items():
+        stages[dict(labels)["stage"]] = {"count": count, "seconds": total}
+    return {
+        "jobs": jobs,
+        "concurrency": concurrency,
+        "sizes": list(sizes),
+        "places": min(places, len(PLACES)),
+        "latency": latency,
+        "seconds": elapsed,
+        "jobs_per_second": jobs / elapsed,
+        "p50": percentile(durations, 0.5),
+        "p95": percentile(durations, 0.95),
+        "max": max(durations),
+        "failed": len(failures),
+        "deleted": sqs.deleted,
+        "render_cache": {k: render_cache.stats[k] - renders_before.get(k, 0) for k in render_cache.stats},
+        "stages": stages,
+    }
+
+
+def print_summary(result):
+    print(f"{result['jobs']} jobs ({','.join(result['sizes'])}, {result['places']} places) at concurrency "
+          f"{result['concurrency']}: {result['seconds']:.2f}s, {result['jobs_per_second']:.2f} jobs/s, "
+          f"p50 {result['p50']:.3f}s p95 {result['p95']:.3f}s, {result['failed']} failed")
+    print(f"render cache: {result['render_cache']}")
+    print(f"{'stage':<16} {'count':>6} {'total':>9} {'mean':>9}")
+    for name, s in sorted(result["stages"].items(), key=lambda item: -item[1]["seconds"]):
+        print(f"{name:<16} {s['count']:>6} {s['seconds']:>8.3f}s {s['seconds'] / s['count']:>8.4f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=12)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--sizes", default="s,m")
+    parser.add_argument("--places", type=int, default=6, help="distinct cities; repeats within a minute hit the render cache")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every stand-in call")
+    parser.add_argument("--out", help="write the result as JSON")
+    args = parser.parse_args()
+
+    result = run(args.jobs, args.concurrency, args.sizes.split(","), args.places, args.latency)
+    print_summary(result)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"e2e": result}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# encode time and output bytes per image format and frame size
+#   python -m benchmarks.encoding [--sizes s,m,l,xl,xxl,verybig] [--constant 1] [--palette inferno]
+import argparse
+import json
+import time
+
+import numpy as np
+
+from image_encoding import encode, get_encoding, to_image
+from julia_kernel import SIZES, julia_grid, render_iterations
+
+VARIANTS = [
+    ("png", {}),
+    ("png", {"compress_level": 1}),
+    ("png", {"compress_level": 9}),
+    ("png", {"compress_type": "filtered"}),
+    ("png", {"compress_type": "rle"}),
+    ("png", {"filter": "sub"}),
+    ("png", {"filter": "up"}),
+    ("png8", {}),
+    ("png8", {"compress_level": 1}),
+    ("png8", {"compress_level": 9}),
+    ("png8", {"compress_type": "rle"}),
+    ("png8", {"filter": "sub"}),
+    ("png8", {"filter": "up"}),
+    ("webp", {}),
+    ("webp", {"lossless": False}),
+]
+
+
+def variant(name, options):
+    enc = get_encoding(name, options.get("compress_level"), options.get("compress_type"), options.get("filter"))
+    if "lossless" in options:
+        enc = enc._replace(params={**enc.params, "lossless": options["lossless"]})
+    label = " ".join([name] + [f"{k}={v}" for k, v in options.items()])
+    return label, enc
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default=",".join(SIZES))
+    parser.add_argument("--constant", type=int, default=1, help="index into sets.json")
+    parser.add_argument("--palette", default="inferno")
+    parser.add_argument("--max-iter", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    with open("sets.json", "r") as f:
+        constant = json.load(f)[args.constant]
+    c = np.complex64(complex(constant["a"], constant["b"]))
+    print(f"constant {args.constant}: a={constant['a']} b={constant['b']}, palette {args.palette}")
+    print(f"{'size':<6} {'format':<32} {'image':>8} {'encode':>8} {'bytes':>11} {'vs png':>7}")
+
+    for size in args.sizes.split(","):
+        w, h = SIZES[size]
+        x, y = julia_grid(w, h)
+        iters = render_iterations(x, y, c, args.max_iter)
+        baseline = None
+        for name, options in VARIANTS:
+            label, enc = variant(name, options)
+            start = time.perf_counter()
+            image = to_image(iters, args.palette, args.max_iter, enc)
+            t_image = time.perf_counter() - start
+            best = None
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                data = encode(image, enc)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            baseline = baseline or len(data)
+            print(f"{size:<6} {label:<32} {t_image:>7.3f}s {best:>7.3f}s {len(data):>11,} {len(data) / baseline:>6.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# peak memory per frame size: the old whole-frame path (image, BytesIO PNG,
+# getvalue, base64) vs. the band-by-band streaming render. each measurement
+# runs in a fresh process (RENDER_WORKERS=1) and reports the tracemalloc peak
+# and the growth of max RSS over the imports
+#   python -m benchmarks.memory [--sizes s,m,l,xl,xxl,verybig] [--format png]
+import argparse
+import base64
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+PATHS = ("whole", "stream")
+
+
+class NullSink:
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        return len(data)
+
+
+def measure(size, path, image_format, constant):
+    from image_encoding import encode, get_encoding, stream_png, to_image
+    from julia_kernel import SIZES, julia_grid, render_bands, render_iterations
+
+    enc = get_encoding(image_format)
+    w, h = SIZES[size]
+    x, y = julia_grid(w, h)
+    c = np.complex64(complex(constant["a"], constant["b"]))
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    if path == "whole":
+        image = to_image(render_iterations(x, y, c, 1000), "inferno", 1000, enc)
+        data = encode(image, enc)
+        encoded = base64.b64encode(data).decode()
+        output = len(data)
+        del image, data, encoded
+    else:
+        sink = NullSink()
+        stream_png(sink, render_bands(x, y, c, 1000), w, h, "inferno", 1000, enc)
+        output = sink.size
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "seconds": elapsed,
+        "traced_peak": peak,
+        "rss_growth": (rss_after - rss_before) * 1024,
+        "bytes": output,
+    }
+
+
+def mb(n):
+    return f"{n / (1 << 20):.1f}"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="s,m,l,xl,xxl,verybig")
+    parser.add_argument("--format", default="png", choices=("png", "png8"))
+    parser.add_argument("--constant", type=int, default=1, help="index into sets.json")
+    parser.add_argument("--one", nargs=2, metavar=("SIZE", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    with open("sets.json", "r") as f:
+        constant = json.load(f)[args.constant]
+
+    if args.one:
+        print(json.dumps(measure(args.one[0], args.one[1], args.format, constant)))
+        return
+
+    env = {**os.environ, "RENDER_WORKERS": "1"}
+    print(f"format {args.format}, constant {args.constant}; memory in MB")
+    print(f"{'size':<8} {'path':<7} {'traced peak':>12} {'rss growth':>11} {'time':>8} {'output':>8}")
+    for size in args.sizes.split(","):
+        for path in PATHS:
+            res = subprocess.run(
+                [sys.executable, "-m", "benchmarks.memory", "--format", args.format,
+                 "--constant", str(args.constant), "--one", size, path],
+                env=env, capture_output=True, text=True, check=True,
+            )
+            r = json.loads(res.stdout.strip().splitlines()[-1])
+            print(f"{size:<8} {path:<7} {mb(r['traced_peak']):>12} {mb(r['rss_growth']):>11} "
+                  f"{r['seconds']:>7.2f}s {mb(r['bytes']):>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+# wall time of render_iterations vs. worker count for every frame size
+#   python -m benchmarks.scaling [--workers 1,2,4,8] [--sizes s,m] [--constant 1]
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from julia_kernel import SIZES, get_pool, julia_grid, render_iterations
+
+
+def time_render(w, h, c, max_iter, workers, tile_rows, repeat):
+    x, y = julia_grid(w, h)
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        render_iterations(x, y, c, max_iter, workers=workers, tile_rows=tile_rows)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    cpus = os.cpu_count() or 1
+    default_workers = sorted({1, 2, 4, 8, 16, cpus} & set(range(1, cpus + 1)))
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", default=",".join(map(str, default_workers)))
+    parser.add_argument("--sizes", default=",".join(SIZES))
+    parser.add_argument("--constant", type=int, default=1, help="index into sets.json")
+    parser.add_argument("--max-iter", type=int, default=1000)
+    parser.add_argument("--tile-rows", type=int, default=None)
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    with open("sets.json", "r") as f:
+        constant = json.load(f)[args.constant]
+    c = np.complex64(complex(constant["a"], constant["b"]))
+    workers = [int(n) for n in args.workers.split(",")]
+
+    # start the pools up front so process spawn isn't billed to the first size
+    for n in workers:
+        if n > 1:
+            get_pool(n).submit(int).result()
+
+    print(f"constant {args.constant}: a={constant['a']} b={constant['b']}, max_iter={args.max_iter}")
+    print(f"{'size':<8} {'pixels':>10} " + " ".join(f"{f'{n}w':>9}" for n in workers) + "  speedup")
+    for size in args.sizes.split(","):
+        w, h = SIZES[size]
+        times = [time_render(w, h, c, args.max_iter, n, args.tile_rows, args.repeat) for n in workers]
+        cols = " ".join(f"{t:>8.2f}s" for t in times)
+        print(f"{size:<8} {w * h:>10} {cols}  {times[0] / times[-1]:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+# brute force vs. rectangle subdivision (mode="subdivide") on every sets.json
+# constant: wall time and pixels that differ from the full render
+#   python -m benchmarks.subdivide [--size s] [--max-iter 1000] [--min-rect 8] [--no-symmetry]
+import argparse
+import json
+import time
+
+import numpy as np
+
+import julia_kernel
+from julia_kernel import SIZES, julia_grid, render_iterations
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", default="s")
+    parser.add_argument("--max-iter", type=int, default=1000)
+    parser.add_argument("--min-rect", type=int, default=julia_kernel.RENDER_MIN_RECT)
+    parser.add_argument("--no-symmetry", action="store_true")
+    args = parser.parse_args()
+
+    julia_kernel.RENDER_MIN_RECT = args.min_rect
+    symmetry = not args.no_symmetry
+    with open("sets.json", "r") as f:
+        constants = json.load(f)
+
+    w, h = SIZES[args.size]
+    x, y = julia_grid(w, h)
+    print(f"size {args.size} ({w}x{h}), max_iter={args.max_iter}, min rect {args.min_rect}, symmetry {symmetry}")
+    print(f"{'const':>5} {'iter 0':>9} {'full':>8} {'subdivide':>10} {'speedup':>8} {'differ':>7}")
+
+    totals = [0.0, 0.0, 0]
+    for i, constant in enumerate(constants):
+        c = np.complex64(complex(constant["a"], constant["b"]))
+        full, t_full = timed(lambda: render_iterations(x, y, c, args.max_iter, workers=1, symmetry=symmetry, mode="full"))
+        sub, t_sub = timed(lambda: render_iterations(x, y, c, args.max_iter, workers=1, symmetry=symmetry, mode="subdivide"))
+        differ = int((full != sub).sum())
+        totals[0] += t_full
+        totals[1] += t_sub
+        totals[2] += differ
+        zero = (full == 0).mean()
+        print(f"{i:>5} {zero:>8.1%} {t_full:>7.2f}s {t_sub:>9.2f}s {t_full / t_sub:>7.2f}x {differ:>7}")
+
+    print(f"{'all':>5} {'':>9} {totals[0]:>7.2f}s {totals[1]:>9.2f}s {totals[0] / totals[1]:>7.2f}x {totals[2]:>7}")
+
+
+if __name__ == "__main__":
+    main()
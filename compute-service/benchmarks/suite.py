@@ -0,0 +1,178 @@
+# the render path of a create_julia_image task (iterate, colorize, encode)
+# for every frame size over a spread of sets.json constants, from the
+# fastest escaping to the most interior, plus the process_message end-to-end
+# run. results go to JSON so two commits can be compared with
+# benchmarks.compare
+#   python -m benchmarks.suite [--sizes s,m,l,xl,xxl,verybig] [--constants auto|1,4,22]
+#       [--out results.json] [--baseline old.json] [--no-e2e]
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+
+from image_encoding import IMAGE_FORMAT, encode, get_encoding, to_image
+from julia_kernel import RENDER_MODE, RENDER_WORKERS, SIZES, get_pool, julia_grid, render_iterations
+from benchmarks import compare, e2e
+
+PROBE_SIZE = (192, 108)
+
+
+def spread(constants, max_iter, count):
+    # rank the distinct constants by work on a small probe frame (interior
+    # points cost max_iter each) and pick `count` evenly from cheap to dear
+    x, y = julia_grid(*PROBE_SIZE)
+    seen = {}
+    for i, constant in enumerate(constants):
+        key = (constant["a"], constant["b"])
+        if key in seen:
+            continue
+        iters = render_iterations(x, y, np.complex64(complex(*key)), max_iter, workers=1)
+        interior = float((iters == 0).mean())
+        seen[key] = (i, interior, float(np.where(iters == 0, max_iter, iters).mean()))
+    ranked = sorted(seen.values(), key=lambda item: item[2])
+    picks = [ranked[round(k * (len(ranked) - 1) / max(count - 1, 1))] for k in range(count)]
+    return {i: interior for i, interior, _ in picks}
+
+
+def stages(x, y, c, max_iter, palette, mode, enc):
+    times = {}
+    start = time.perf_counter()
+    iters = render_iterations(x, y, c, max_iter, mode=mode)
+    times["iterate"] = time.perf_counter() - start
+    start = time.perf_counter()
+    image = to_image(iters, palette, max_iter, enc)
+    times["colorize"] = time.perf_counter() - start
+    start = time.perf_counter()
+    data = encode(image, enc)
+    times["encode"] = time.perf_counter() - start
+    return times, len(data)
+
+
+def bench(size, index, constant, interior, args, enc):
+    w, h = SIZES[size]
+    x, y = julia_grid(w, h)
+    c = np.complex64(complex(constant["a"], constant["b"]))
+
+    best = None
+    for _ in range(args.repeat):
+        times, output = stages(x, y, c, args.max_iter, args.palette, args.mode, enc)
+        if best is None or sum(times.values()) < sum(best.values()):
+            best = times
+
+    # separate run for memory: tracemalloc slows allocation-heavy code down.
+    # only this process is traced, not the render pool's workers
+    peak = None
+    if not args.no_memory:
+        tracemalloc.start()
+        stages(x, y, c, args.max_iter, args.palette, args.mode, enc)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    total = sum(best.values())
+    return {
+        "size": size,
+        "constant": index,
+        "a": constant["a"],
+        "b": constant["b"],
+        "interior": interior,
+        "max_iter": args.max_iter,
+        "pixels": w * h,
+        **best,
+        "total": total,
+        "pixels_per_second": w * h / total,
+        "peak_bytes": peak,
+        "output_bytes": output,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default=",".join(SIZES))
+    parser.add_argument("--constants", default="auto", help="'auto' or indexes into sets.json")
+    parser.add_argument("--spread", type=int, default=3, help="constants picked by --constants auto")
+    parser.add_argument("--max-iter", type=int, default=1000)
+    parser.add_argument("--palette", default="inferno")
+    parser.add_argument("--mode", default=RENDER_MODE, choices=("full", "subdivide"))
+    parser.add_argument("--format", default=IMAGE_FORMAT, choices=("png", "png8", "webp"))
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per case, best kept")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc run")
+    parser.add_argument("--no-e2e", action="store_true")
+    parser.add_argument("--e2e-jobs", type=int, default=12)
+    parser.add_argument("--e2e-concurrency", type=int, default=4)
+    parser.add_argument("--out", help="write results as JSON")
+    parser.add_argument("--baseline", help="results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args()
+
+    with open("sets.json", "r") as f:
+        constants = json.load(f)
+    if args.constants == "auto":
+        picked = spread(constants, args.max_iter, args.spread)
+    else:
+        picked = {int(i): None for i in args.constants.split(",")}
+    enc = get_encoding(args.format)
+    if RENDER_WORKERS > 1:
+        get_pool(RENDER_WORKERS).submit(int).result()
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "created": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "render_workers": RENDER_WORKERS,
+            "mode": args.mode,
+            "format": args.format,
+            "palette": args.palette,
+            "repeat": args.repeat,
+        },
+        "kernel": [],
+    }
+
+    print(f"{'size':<8} {'const':>5} {'interior':>8} {'iterate':>8} {'colorize':>9} {'encode':>8} "
+          f"{'Mpx/s':>7} {'peak MB':>8}")
+    for size in args.sizes.split(","):
+        for index, interior in picked.items():
+            row = bench(size, index, constants[index], interior, args, enc)
+            results["kernel"].append(row)
+            peak = f"{row['peak_bytes'] / (1 << 20):.1f}" if row["peak_bytes"] is not None else "-"
+            shown = f"{interior:.1%}" if interior is not None else "-"
+            print(f"{size:<8} {index:>5} {shown:>8} {row['iterate']:>7.3f}s {row['colorize']:>8.3f}s "
+                  f"{row['encode']:>7.3f}s {row['pixels_per_second'] / 1e6:>7.2f} {peak:>8}")
+
+    if not args.no_e2e:
+        print()
+        results["e2e"] = e2e.run(args.e2e_jobs, args.e2e_concurrency)
+        e2e.print_summary(results["e2e"])
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"wrote {args.out}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print()
+        if compare.report(compare.compare(baseline, results, args.threshold), baseline, results):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# render_iterations with and without the 180 degree symmetry shortcut: checks
+# the frames are identical and reports the time saved
+#   python -m benchmarks.symmetry [--sizes s,m] [--constants 0,1,4] [--workers 1]
+import argparse
+import json
+import time
+
+import numpy as np
+
+from julia_kernel import SIZES, get_pool, julia_grid, mirror_rows, render_iterations
+
+# centred viewports mirror; off-centre ones must fall back to a full render
+VIEWPORTS = [((0.0, 0.0), 1.0), ((0.0, 0.0), 2.5), ((0.0, 0.1), 1.0), ((0.2, 0.0), 1.5)]
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="s,m")
+    parser.add_argument("--constants", default=None, help="indexes into sets.json (default: all)")
+    parser.add_argument("--max-iter", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--check-size", default="200x113", help="frame used for the equivalence sweep")
+    args = parser.parse_args()
+
+    with open("sets.json", "r") as f:
+        constants = json.load(f)
+    picked = range(len(constants)) if args.constants is None else [int(i) for i in args.constants.split(",")]
+
+    # exactness: every constant, every viewport, on a small frame
+    w, h = (int(n) for n in args.check_size.split("x"))
+    for i in picked:
+        c = np.complex64(complex(constants[i]["a"], constants[i]["b"]))
+        for center, zoom in VIEWPORTS:
+            x, y = julia_grid(w, h, center, zoom)
+            full = render_iterations(x, y, c, args.max_iter, workers=1, symmetry=False)
+            half = render_iterations(x, y, c, args.max_iter, workers=1, symmetry=True)
+            assert np.array_equal(full, half), (i, center, zoom)
+    print(f"{len(picked)} constants x {len(VIEWPORTS)} viewports at {w}x{h}: identical")
+
+    if args.workers and args.workers > 1:
+        get_pool(args.workers).submit(int).result()
+    print(f"{'size':<8} {'const':>5} {'mirrored':>9} {'full':>8} {'symmetric':>10}  speedup")
+    for size in args.sizes.split(","):
+        w, h = SIZES[size]
+        x, y = julia_grid(w, h)
+        mirror = mirror_rows(x, y)
+        mirrored = len(mirror[1]) if mirror else 0
+        for i in picked[:3]:
+            c = np.complex64(complex(constants[i]["a"], constants[i]["b"]))
+            full, t_full = timed(lambda: render_iterations(x, y, c, args.max_iter, args.workers, symmetry=False))
+            half, t_half = timed(lambda: render_iterations(x, y, c, args.max_iter, args.workers, symmetry=True))
+            assert np.array_equal(full, half), (size, i)
+            print(f"{size:<8} {i:>5} {mirrored:>9} {t_full:>7.2f}s {t_half:>9.2f}s  {t_full / t_half:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
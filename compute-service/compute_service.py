@@ -1,51 +1,129 @@
 import os
 import json
 import time
-import base64
 import hashlib
 from collections import namedtuple
-from functools import lru_cache
 from datetime import datetime
-from io import BytesIO
 import asyncio
+import argparse
+import signal
 
 import numpy as np
-from PIL import Image
-import matplotlib.cm as cm
 import httpx
-import boto3
 from dotenv import load_dotenv
 
+from julia_kernel import RENDER_MODE, RENDER_MODES, SIZES, get_size_dimensions, julia_grid, render_bands, render_iterations, warm_render_pool
+import render_cache
+from image_encoding import cache_format, encode, get_encoding, stream_png, to_image, write_image
+from image_stream import thread_chunks
+from time_lookup import TimeLookup
+from sqs_consumer import SqsConsumer, lane
+import metrics
+from palettes import get_lut
+from startup import Warmup, aws_client, once
+
 load_dotenv()
 
 AWS_REGION = os.getenv("AWS_REGION", "ap-southeast-2")
 DATA_SERVICE_URL = os.getenv("DATA_SERVICE_URL")
 SQS_QUEUE_URL = os.getenv("SQS_QUEUE_URL")
-
-sqs = boto3.client("sqs", region_name=AWS_REGION)
-ssm = boto3.client("ssm", region_name=AWS_REGION)
+# priority lanes, cheapest first; each lane may have its own queue and
+# unset lanes fall back to SQS_QUEUE_URL
+SQS_LANE_WEIGHTS = os.getenv("SQS_LANE_WEIGHTS", "small=6,medium=3,large=1")
+SQS_CONCURRENCY = int(os.getenv("SQS_CONCURRENCY", "4"))
+SQS_VISIBILITY_TIMEOUT = int(os.getenv("SQS_VISIBILITY_TIMEOUT", "120"))
+SQS_HEARTBEAT_INTERVAL = int(os.getenv("SQS_HEARTBEAT_INTERVAL", "30"))
+PRERENDER_INDEX = os.getenv("PRERENDER_INDEX", "prerender_index.json")
+# PNG frames this big are rendered, encoded and uploaded band by band
+RENDER_STREAM_PIXELS = int(os.getenv("RENDER_STREAM_PIXELS", "12000000"))
+# worker /metrics sidecar; 0 disables it
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+# local timezone answers, used only once they've matched the time API's format
+LOCAL_TIMEZONES = os.getenv("LOCAL_TIMEZONES", "1") == "1"
+TIME_DATE_FORMAT = os.getenv("TIME_DATE_FORMAT", "%m/%d/%Y")
+TIME_TIME_FORMAT = os.getenv("TIME_TIME_FORMAT", "%H:%M")
+
+# shared outbound connection pool
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "50"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+HTTP2 = os.getenv("HTTP2", "0") == "1"  # needs the h2 package
 
 with open("sets.json", "r") as f:
     julia_constants = json.load(f)
 
+http_client = None
+
 julia_res = namedtuple(
     "julia_res", ["image", "real", "imaginary", "iters", "width", "height"]
 )
 
-external_api_response = ssm.get_parameter(
-    Name="/n10807144-a2/external-api",
-    WithDecryption=True
+
+@once
+def get_sqs():
+    return aws_client("sqs", region_name=AWS_REGION)
+
+
+@once
+def get_ssm():
+    return aws_client("ssm", region_name=AWS_REGION)
+
+
+@once
+def get_external_api_url():
+    res = get_ssm().get_parameter(Name="/n10807144-a2/external-api", WithDecryption=True)
+    return res["Parameter"]["Value"]
+
+
+def get_http_client():
+    global http_client
+    if http_client is None:
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+            timeout=HTTP_TIMEOUT,
+            http2=HTTP2,
+            event_hooks={"request": [metrics.add_trace_header]},
+        )
+    return http_client
+
+
+async def close_http_client():
+    global http_client
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
+
+
+async def fetch_time(country, city):
+    url = f"{await asyncio.to_thread(get_external_api_url)}{country}%2F{city}"
+    res = await get_http_client().get(url, timeout=15)
+    res.raise_for_status()
+    data = res.json()
+    return data["date"], data["time"]
+
+
+time_lookup = TimeLookup(
+    fetch_time,
+    date_format=TIME_DATE_FORMAT,
+    time_format=TIME_TIME_FORMAT,
+    local=LOCAL_TIMEZONES,
 )
-EXTERNAL_API_URL = external_api_response["Parameter"]["Value"]
+
+
+metrics.register_stats("time_lookup", lambda: time_lookup.stats)
+metrics.register_stats("render_cache", lambda: render_cache.stats)
+jobs = metrics.counter("jobs_total", "Processed julia tasks by outcome")
+
 
 async def get_time(country, city):
-    url = f"{EXTERNAL_API_URL}{country}%2F{city}"
     try:
-        async with httpx.AsyncClient(timeout=15) as c:
-            res = await c.get(url)
-            res.raise_for_status()
-            data = res.json()
-            return data["date"], data["time"]
+        return await time_lookup.get(country, city)
     except Exception as e:
         print(f"failed to get time for {city}, {country}: {e}")
     return None
@@ -68,122 +146,313 @@ async def map_to_julia_constants(country, city):
     return c["a"], c["b"]
 
 
-@lru_cache(maxsize=None)
-def get_size_dimensions(size: str):
-    size_map = {
-        "s": (1000, 563),
-        "m": (2000, 1125),
-        "l": (3000, 1688),
-        "xl": (4000, 2250),
-        "xxl": (5000, 2813),
-        "verybig": (8000, 4500),
-    }
-    return size_map.get(size.lower(), (2000, 1125))
-
-
-async def create_julia_image(country, city, size, center=(0.0, 0.0), zoom=1.0, max_iter=1000):
-    a, b = await map_to_julia_constants(country, city)
+def render_julia(a, b, size, center=(0.0, 0.0), zoom=1.0, max_iter=1000, palette="inferno", mode=None, enc=None):
     w, h = get_size_dimensions(size)
-    half_x = 1.5 / zoom
-    half_y = (h / w) * half_x
-
-    x = np.linspace(center[0] - half_x, center[0] + half_x, w, dtype=np.float32)
-    y = np.linspace(center[1] - half_y, center[1] + half_y, h, dtype=np.float32)
+    x, y = julia_grid(w, h, center, zoom)
 
     C = np.complex64(complex(a, b))
-    img = Image.new("RGB", (w, h))
-
-    for j, y_val in enumerate(y):
-        X_row = x.astype(np.complex64)
-        Y_row = np.full_like(X_row, y_val, dtype=np.float32)
-        Z = X_row + 1j * Y_row
-        iters_row = np.zeros(Z.shape, dtype=np.uint16)
-        alive = np.ones(Z.shape, dtype=bool)
-
-        for i in range(max_iter):
-            Z[alive] = Z[alive] * Z[alive] + C
-            escaped = np.abs(Z) > 2.0
-            iters_row[escaped & alive] = i
-            alive &= ~escaped
-            if not alive.any():
-                break
-
-        norm_row = iters_row / max_iter
-        colored_row = (cm.inferno(norm_row)[:, :3] * 255).astype(np.uint8)
-        row_img = Image.fromarray(colored_row[np.newaxis, :, :], mode="RGB")
-        img.paste(row_img, (0, j))
+    with metrics.maybe_profile("render"):
+        iters = render_iterations(x, y, C, max_iter, mode=mode)
+        img = to_image(iters, palette, max_iter, enc or get_encoding())
 
     return julia_res(image=img, real=float(a), imaginary=float(b), iters=max_iter, width=w, height=h)
 
-async def upload_image(key: str, image_bytes: bytes):
-    img_b64 = base64.b64encode(image_bytes).decode("utf-8")
-    async with httpx.AsyncClient() as client:
-        await client.post(f"{DATA_SERVICE_URL}/s3/upload", json={
-            "key": key,
-            "image_base64": img_b64
-        })
+
+def render_julia_stream(out, a, b, size, max_iter=1000, palette="inferno", mode=None, enc=None):
+    w, h = get_size_dimensions(size)
+    x, y = julia_grid(w, h)
+
+    C = np.complex64(complex(a, b))
+    bands = render_bands(x, y, C, max_iter, mode=mode)
+    with metrics.maybe_profile("render"):
+        stream_png(out, bands, w, h, palette, max_iter, enc or get_encoding())
+
+
+async def upload_image(key: str, image_bytes: bytes, content_type: str = "image/png"):
+    client = get_http_client()
+    res = await client.put(
+        f"{DATA_SERVICE_URL}/s3/object/{key}",
+        content=image_bytes,
+        headers={"content-type": content_type}
+    )
+    res.raise_for_status()
+
+async def upload_image_stream(key: str, image, enc):
+    # chunked body straight from the encoder; data-service pipes it into S3
+    client = get_http_client()
+    res = await client.put(
+        f"{DATA_SERVICE_URL}/s3/object/{key}",
+        content=thread_chunks(lambda out: write_image(out, image, enc)),
+        headers={"content-type": enc.content_type}
+    )
+    res.raise_for_status()
+
+async def upload_render_stream(key: str, a, b, size, max_iter, palette, mode, enc):
+    # rendering, coloring and encoding all happen band by band in a worker
+    # thread, so neither the frame nor the encoded file is ever held whole
+    client = get_http_client()
+    res = await client.put(
+        f"{DATA_SERVICE_URL}/s3/object/{key}",
+        content=thread_chunks(lambda out: render_julia_stream(out, a, b, size, max_iter, palette, mode, enc)),
+        headers={"content-type": enc.content_type}
+    )
+    res.raise_for_status()
+
+async def render_and_store(key: str, a, b, size, max_iter, palette, mode, enc):
+    w, h = get_size_dimensions(size)
+    if enc.format == "PNG" and not render_cache.RENDER_CACHE_DIR and w * h >= RENDER_STREAM_PIXELS:
+        await upload_render_stream(key, a, b, size, max_iter, palette, mode, enc)
+        return
+    # off the event loop so other jobs and visibility heartbeats keep running
+    result = await asyncio.to_thread(
+        render_julia, a, b, size, max_iter=max_iter, palette=palette, mode=mode, enc=enc
+    )
+    await store_render(key, result.image, enc)
+
+async def store_render(key: str, image, enc):
+    if render_cache.RENDER_CACHE_DIR:
+        # the local tier needs the encoded bytes anyway
+        image_bytes = await asyncio.to_thread(encode, image, enc)
+        render_cache.write_local(key, image_bytes)
+        await upload_image(key, image_bytes, enc.content_type)
+    else:
+        await upload_image_stream(key, image, enc)
+
+async def copy_image(source_key: str, key: str):
+    client = get_http_client()
+    res = await client.post(f"{DATA_SERVICE_URL}/s3/copy", json={
+        "source_key": source_key,
+        "key": key
+    })
+    if res.status_code == 404:
+        return False
+    res.raise_for_status()
+    return True
+
+async def image_exists(key: str):
+    client = get_http_client()
+    res = await client.get(f"{DATA_SERVICE_URL}/s3/exists/{key}")
+    res.raise_for_status()
+    return res.json().get("exists", False)
 
 async def put_metadata(metadata: dict):
-    async with httpx.AsyncClient() as client:
-        await client.post(f"{DATA_SERVICE_URL}/db/put", json=metadata)
+    client = get_http_client()
+    await client.post(f"{DATA_SERVICE_URL}/db/put", json=metadata)
 
 
 async def cache_file(filename: str):
-    async with httpx.AsyncClient() as client:
-        await client.post(f"{DATA_SERVICE_URL}/cache/{filename}")
+    client = get_http_client()
+    await client.post(f"{DATA_SERVICE_URL}/cache/{filename}")
+
+async def clear_pending(filename: str):
+    client = get_http_client()
+    try:
+        await client.delete(f"{DATA_SERVICE_URL}/cache/{filename}/pending")
+    except Exception as e:
+        print(f"failed to clear pending marker for {filename}: {e}")
+
+async def render_cached(a, b, size, file_name, max_iter=1000, palette="inferno", mode=RENDER_MODE, image_format=None):
+    w, h = get_size_dimensions(size)
+    enc = get_encoding(image_format)
+    key = render_cache.render_key(a, b, w, h, (0.0, 0.0), 1.0, max_iter, palette, mode, cache_format(enc), enc.extension)
+
+    # identical parameters were rendered before: alias the stored object
+    with metrics.stage("copy"):
+        copied = await copy_image(key, file_name)
+    if copied:
+        render_cache.record("hits")
+        return
+
+    image_bytes = render_cache.read_local(key)
+    if image_bytes is not None:
+        render_cache.record("local_hits")
+        await upload_image(key, image_bytes, enc.content_type)
+    else:
+        render_cache.record("misses")
+        with metrics.stage("render"):
+            await render_and_store(key, a, b, size, max_iter, palette, mode, enc)
+
+    with metrics.stage("copy"):
+        copied = await copy_image(key, file_name)
+    if not copied:
+        raise RuntimeError(f"failed to store {key} as {file_name}")
 
 async def process_message(task):
+    # the gateway's trace id, so this job's data-service calls can be matched up
+    metrics.trace_id.set(task.get("trace_id") or metrics.new_trace_id())
+    outcome = "failed"
+    try:
+        with metrics.stage("job"):
+            outcome = await handle_task(task)
+    finally:
+        jobs.inc(outcome=outcome)
+
+
+async def handle_task(task):
     country = task["country"]
     city = task["city"]
     size = task["size"]
     file_name = task["file_name"]
+    mode = task.get("render_mode") or RENDER_MODE
+    # the format the gateway named the file for
+    image_format = task.get("image_format")
+    max_iter = 1000
 
-    print(f"processing julia task for {file_name}")
+    print(f"processing julia task for {file_name} (trace {metrics.trace_id.get()})")
 
-    result = await create_julia_image(country, city, size)
-    buf = BytesIO()
-    result.image.save(buf, format="PNG")
-    buf.seek(0)
+    # duplicate or redelivered task whose output is already stored
+    if await image_exists(file_name):
+        await cache_file(file_name)
+        print(f"skipping {file_name}, already exists")
+        return "skipped"
 
-    await upload_image(file_name, buf.getvalue())
-    await cache_file(file_name)
+    with metrics.stage("time_lookup"):
+        a, b = await map_to_julia_constants(country, city)
+    w, h = get_size_dimensions(size)
+    try:
+        await render_cached(a, b, size, file_name, max_iter, mode=mode, image_format=image_format)
+    except Exception:
+        # let the next request for this file queue it again
+        await clear_pending(file_name)
+        raise
+    with metrics.stage("cache_file"):
+        await cache_file(file_name)
 
     metadata = {
         "file_name": file_name,
         "region": country,
         "city": city,
         "size": size,
-        "resolution": {"width": result.width, "height": result.height},
-        "params": {"real": result.real, "imaginary": result.imaginary, "iterations": result.iters},
+        "resolution": {"width": w, "height": h},
+        "params": {"real": float(a), "imaginary": float(b), "iterations": max_iter},
         "generated_at": datetime.utcnow().isoformat()
     }
-    await put_metadata(metadata)
+    with metrics.stage("metadata"):
+        await put_metadata(metadata)
 
     print(f"completed Julia image {file_name}")
+    return "completed"
 
 
-async def poll_sqs():
-    while True:
-        messages = sqs.receive_message(
-            QueueUrl=SQS_QUEUE_URL,
-            MaxNumberOfMessages=5,
-            WaitTimeSeconds=10
-        ).get("Messages", [])
-
-        if not messages:
-            await asyncio.sleep(1)
+def get_lanes():
+    lanes = {}
+    for entry in SQS_LANE_WEIGHTS.split(","):
+        name, weight = entry.split("=")
+        queue_url = os.getenv(f"SQS_QUEUE_URL_{name.upper()}", SQS_QUEUE_URL)
+        # lanes sharing a queue are polled once
+        if queue_url in lanes:
             continue
+        lanes[queue_url] = lane(name, queue_url, int(weight))
+    return list(lanes.values())
+
+
+warmup = Warmup({
+    "sqs": get_sqs,
+    "external_api_url": get_external_api_url,
+    "palette": lambda: get_lut("inferno", 1000),
+    "render_pool": warm_render_pool,
+})
+
+
+async def poll_sqs():
+    # the sidecar answers /healthz at once; messages are only taken once
+    # everything they need has been built
+    if METRICS_PORT:
+        metrics.start_http_server(METRICS_PORT, warmup=warmup)
+    if warmup.mode != "off":
+        await warmup.run()
+    consumer = SqsConsumer(
+        get_sqs(),
+        get_lanes(),
+        process_message,
+        concurrency=SQS_CONCURRENCY,
+        visibility_timeout=SQS_VISIBILITY_TIMEOUT,
+        heartbeat_interval=SQS_HEARTBEAT_INTERVAL,
+    )
+    # per lane queue wait on /metrics, e.g. lanes_small_wait_max
+    metrics.register_stats("lanes", lambda: {
+        f"{name}_{key}": value for name, stats in consumer.lane_stats().items() for key, value in stats.items()
+    })
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, consumer.stop)
+    get_http_client()
+    try:
+        await consumer.run()
+    finally:
+        await close_http_client()
+
+
+def load_prerender_index(path):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_prerender_index(path, index):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+async def prerender(sizes, concurrency=2, max_iter=1000, palette="inferno", index_path=PRERENDER_INDEX, mode=RENDER_MODE):
+    # renders every sets.json constant at every size into the render cache;
+    # resumable: keys in the index or already in S3 are skipped
+    index = load_prerender_index(index_path)
+    enc = get_encoding()
+    sem = asyncio.Semaphore(concurrency)
+    done = {"rendered": 0, "skipped": 0, "failed": 0}
+
+    jobs = {}
+    for c in julia_constants:
+        for size in sizes:
+            w, h = get_size_dimensions(size)
+            key = render_cache.render_key(
+                c["a"], c["b"], w, h, (0.0, 0.0), 1.0, max_iter, palette, mode, cache_format(enc), enc.extension
+            )
+            jobs.setdefault(key, (c["a"], c["b"], size))
+
+    async def warm(key, a, b, size):
+        async with sem:
+            if key in index or await image_exists(key):
+                done["skipped"] += 1
+            else:
+                await render_and_store(key, a, b, size, max_iter, palette, mode, enc)
+                done["rendered"] += 1
+                print(f"prerendered {key} (a={a}, b={b}, size={size})")
+            index[key] = {"a": a, "b": b, "size": size, "max_iter": max_iter, "palette": palette}
+            save_prerender_index(index_path, index)
+
+    async def warm_safe(key, *params):
+        try:
+            await warm(key, *params)
+        except Exception as e:
+            done["failed"] += 1
+            print(f"failed to prerender {key}: {e}")
+
+    get_http_client()
+    try:
+        await asyncio.gather(*(warm_safe(key, *params) for key, params in jobs.items()))
+    finally:
+        await close_http_client()
+    print(f"prerender finished: {done}")
 
-        for msg in messages:
-            try:
-                body = json.loads(msg["Body"])
-                await process_message(body)
-                sqs.delete_message(
-                    QueueUrl=SQS_QUEUE_URL,
-                    ReceiptHandle=msg["ReceiptHandle"]
-                )
-            except Exception as e:
-                print(f"Failed to process message: {e}")
 
 if __name__ == "__main__":
-    asyncio.run(poll_sqs())
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("poll", help="consume julia tasks from SQS (default)")
+    warm_parser = commands.add_parser("prerender", help="render every sets.json constant at every size")
+    warm_parser.add_argument("--sizes", default=",".join(SIZES))
+    warm_parser.add_argument("--concurrency", type=int, default=2)
+    warm_parser.add_argument("--index", default=PRERENDER_INDEX)
+    warm_parser.add_argument("--mode", choices=RENDER_MODES, default=RENDER_MODE)
+    args = parser.parse_args()
+
+    if args.command == "prerender":
+        asyncio.run(prerender(args.sizes.split(","), args.concurrency, index_path=args.index, mode=args.mode))
+    else:
+        asyncio.run(poll_sqs())
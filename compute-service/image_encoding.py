@@ -0,0 +1,107 @@
+import os
+import zlib
+from collections import namedtuple
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from image_formats import IMAGE_FORMAT, get_format
+from palettes import colorize, colorize_indexed, get_indexed
+from png_stream import FILTERS, PngWriter
+
+# zlib level 0-9 and strategy: default, filtered, huffman, rle or fixed
+PNG_COMPRESS_LEVEL = int(os.getenv("PNG_COMPRESS_LEVEL", "6"))
+PNG_COMPRESS_TYPE = os.getenv("PNG_COMPRESS_TYPE", "default")
+# PNG row filter: none, sub or up. every PNG goes through PngWriter, whole
+# frames too, since Pillow picks its own filter per row and can't be told
+PNG_FILTER = os.getenv("PNG_FILTER", "none")
+WEBP_LOSSLESS = os.getenv("WEBP_LOSSLESS", "1") == "1"
+WEBP_QUALITY = int(os.getenv("WEBP_QUALITY", "80"))
+WEBP_METHOD = int(os.getenv("WEBP_METHOD", "4"))
+
+COMPRESS_TYPES = {
+    "default": zlib.Z_DEFAULT_STRATEGY,
+    "filtered": zlib.Z_FILTERED,
+    "huffman": zlib.Z_HUFFMAN_ONLY,
+    "rle": zlib.Z_RLE,
+    "fixed": zlib.Z_FIXED,
+}
+
+encoding = namedtuple("encoding", ["name", "format", "extension", "content_type", "paletted", "params"])
+
+
+def get_encoding(name=None, compress_level=None, compress_type=None, filter=None):
+    name = name or IMAGE_FORMAT
+    fmt = get_format(name)
+    if name in ("png", "png8"):
+        params = {
+            "compress_level": PNG_COMPRESS_LEVEL if compress_level is None else compress_level,
+            "compress_type": COMPRESS_TYPES[compress_type or PNG_COMPRESS_TYPE],
+            "filter": filter or PNG_FILTER,
+        }
+        if params["filter"] not in FILTERS:
+            raise ValueError(f"unknown PNG filter: {params['filter']}")
+        return encoding(name, "PNG", fmt.extension, fmt.content_type, name == "png8", params)
+    params = {"lossless": WEBP_LOSSLESS, "quality": WEBP_QUALITY, "method": WEBP_METHOD}
+    return encoding(name, "WEBP", fmt.extension, fmt.content_type, False, params)
+
+
+def cache_format(enc):
+    # what the stored bytes decode to: every PNG variant gives the same pixels,
+    # lossy WebP depends on its quality
+    if enc.format == "PNG":
+        return "png"
+    if enc.params.get("lossless"):
+        return "webp"
+    return f"webp-q{enc.params['quality']}"
+
+
+def to_image(iters, palette, max_iter, enc):
+    if enc.paletted:
+        indexed = colorize_indexed(iters, palette, max_iter)
+        if indexed is not None:
+            pixels, colors = indexed
+            img = Image.fromarray(pixels, "P")
+            img.putpalette(colors)
+            return img
+        print(f"palette {palette} has more than 256 colors, encoding {enc.name} as RGB")
+    return Image.fromarray(colorize(iters, palette, max_iter))
+
+
+def png_writer(out, width, height, palette, enc):
+    return PngWriter(
+        out, width, height,
+        palette=palette,
+        compress_level=enc.params["compress_level"],
+        compress_type=enc.params["compress_type"],
+        filter=enc.params["filter"],
+    )
+
+
+def write_image(out, image, enc, rows=256):
+    # encodes a whole frame into the file-like `out`
+    if enc.format != "PNG":
+        image.save(out, format=enc.format, **enc.params)
+        return
+    pixels = np.asarray(image)
+    writer = png_writer(out, image.width, image.height, image.getpalette() if image.mode == "P" else None, enc)
+    for j in range(0, image.height, rows):
+        writer.write_rows(pixels[j:j + rows])
+    writer.close()
+
+
+def encode(image, enc):
+    buf = BytesIO()
+    write_image(buf, image, enc)
+    return buf.getvalue()
+
+
+def stream_png(out, bands, width, height, palette, max_iter, enc):
+    # colors and deflates iteration bands as they arrive, for frames too big
+    # to hold as an image
+    indexed = get_indexed(palette, max_iter) if enc.paletted else None
+    writer = png_writer(out, width, height, None if indexed is None else indexed[1], enc)
+    for band in bands:
+        writer.write_rows(colorize(band, palette, max_iter) if indexed is None else indexed[0][band])
+    writer.close()
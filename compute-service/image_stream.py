@@ -0,0 +1,52 @@
+import asyncio
+import threading
+
+
+class _QueueWriter:
+    # file-like sink for an encoder thread: each write blocks until the event
+    # loop has room for the chunk, so at most `depth` chunks are buffered
+    def __init__(self, queue, loop, cancelled):
+        self.queue = queue
+        self.loop = loop
+        self.cancelled = cancelled
+
+    def write(self, data):
+        if self.cancelled.is_set():
+            raise RuntimeError("image stream closed")
+        asyncio.run_coroutine_threadsafe(self.queue.put(bytes(data)), self.loop).result()
+        return len(data)
+
+
+async def thread_chunks(produce, depth=4):
+    # runs produce(out) in a worker thread and yields whatever it writes to the
+    # file-like `out` as it is written, without building the full output
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=depth)
+    cancelled = threading.Event()
+    done = object()
+
+    def run():
+        try:
+            produce(_QueueWriter(queue, loop, cancelled))
+            item = done
+        except BaseException as e:
+            item = e
+        if not cancelled.is_set():
+            asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+    producer = asyncio.ensure_future(asyncio.to_thread(run))
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        # consumer went away early: unblock and stop the producer thread
+        cancelled.set()
+        while not producer.done():
+            while not queue.empty():
+                queue.get_nowait()
+            await asyncio.sleep(0.01)
@@ -0,0 +1,372 @@
+import os
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# pixels per band; bounds the working set of the kernel to a few MB on big frames
+BAND_PIXELS = int(os.getenv("RENDER_BAND_PIXELS", str(1 << 20)))
+
+# parallel mode: worker processes (<= 1 renders in-process) and rows per tile
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", str(os.cpu_count() or 1)))
+RENDER_TILE_ROWS = int(os.getenv("RENDER_TILE_ROWS", "64"))
+
+# fill rows that are the 180 degree rotation of another row instead of rendering them
+RENDER_SYMMETRY = os.getenv("RENDER_SYMMETRY", "1") == "1"
+
+# "full" iterates every pixel; "subdivide" fills rectangles with uniform borders.
+# subdivide only pays off when large areas share one count, i.e. frames with
+# big never-escaping interiors (sets.json 22-24: 2.5-6x faster at size s). on
+# fast-escaping, dust-like constants it still iterates most pixels, plus the
+# borders, and is about 2x slower; hence full is the default
+RENDER_MODES = ("full", "subdivide")
+RENDER_MODE = os.getenv("RENDER_MODE", "full")
+RENDER_MIN_RECT = int(os.getenv("RENDER_MIN_RECT", "8"))
+
+SIZES = {
+    "s": (1000, 563),
+    "m": (2000, 1125),
+    "l": (3000, 1688),
+    "xl": (4000, 2250),
+    "xxl": (5000, 2813),
+    "verybig": (8000, 4500),
+}
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+# |z|^2 this close to 4 is re-checked with np.abs so escapes match the
+# original row-by-row renderer bit for bit
+_EDGE_LO = np.float32(4.0 * (1 - 1e-5))
+_EDGE_HI = np.float32(4.0 * (1 + 1e-5))
+
+# cycle checks start here (a power of two): most escaping points are gone by
+# then, so the extra compare only runs over slow and interior points
+_CYCLE_START = 8
+
+
+@lru_cache(maxsize=None)
+def get_size_dimensions(size: str):
+    return SIZES.get(size.lower(), (2000, 1125))
+
+
+def julia_grid(w, h, center=(0.0, 0.0), zoom=1.0):
+    half_x = 1.5 / zoom
+    half_y = (h / w) * half_x
+    x = np.linspace(center[0] - half_x, center[0] + half_x, w, dtype=np.float32)
+    y = np.linspace(center[1] - half_y, center[1] + half_y, h, dtype=np.float32)
+    return x, y
+
+
+def _escaped(z, mag2, out):
+    np.greater_equal(mag2, _EDGE_LO, out=out)
+    if not out.any():
+        return False
+    pos = np.flatnonzero(out)
+    edge = pos[mag2[pos] <= _EDGE_HI]
+    if edge.size:
+        out[edge] = np.abs(z[edge]) > 2.0
+    return out.any()
+
+
+# iterates z = z*z + c over the flat complex64 array z (consumed), writing each
+# point's escape iteration into out (0 if it never escapes). only live points
+# are iterated: z is compacted alongside an index array as points escape.
+# with periodicity, z is compared bit for bit against a value saved at each
+# power of two iterations (Brent); an exact repeat means the point cycles
+# forever, so it is dropped as non-escaping without changing the result
+def escape_time(z, c, max_iter, out, periodicity=False):
+    c = np.complex64(c)
+    idx = np.arange(z.size, dtype=np.intp)
+    sq = np.empty(2 * z.size, dtype=np.float32)
+    mag2 = np.empty(z.size, dtype=np.float32)
+    escaped = np.empty(z.size, dtype=bool)
+    saved = z.copy() if periodicity else None
+    cycled = np.empty(z.size, dtype=bool)
+    save_at = _CYCLE_START
+
+    out[:] = 0
+    for i in range(max_iter):
+        if z.size > 1:
+            np.multiply(z, z, out=z)
+        else:
+            # numpy's in-place loop for a single element rounds without the
+            # FMA every other path uses; stay on the same rounding
+            z[:] = z * z
+        z += c
+        np.multiply(z.view(np.float32), z.view(np.float32), out=sq)
+        np.add(sq[0::2], sq[1::2], out=mag2)
+
+        done = _escaped(z, mag2, escaped)
+        if done:
+            out[idx[escaped]] = i
+        if saved is not None and i + 1 >= _CYCLE_START:
+            if i + 1 == save_at:
+                saved[:] = z
+                save_at *= 2
+            else:
+                np.equal(z.view(np.uint64), saved.view(np.uint64), out=cycled)
+                if cycled.any():
+                    escaped |= cycled
+                    done = True
+        if not done:
+            continue
+
+        alive = ~escaped
+        if not alive.any():
+            break
+        idx = idx[alive]
+        z = z[alive]
+        if saved is not None:
+            saved = saved[alive]
+        n = idx.size
+        sq = sq[:2 * n]
+        mag2 = mag2[:n]
+        escaped = escaped[:n]
+        cycled = cycled[:n]
+    return out
+
+
+def _points(x, y, rows, cols, c, max_iter):
+    z = np.empty(rows.size, dtype=np.complex64)
+    z.real = x[cols]
+    z.imag = y[rows]
+    out = np.empty(rows.size, dtype=np.uint16)
+    return escape_time(z, c, max_iter, out, periodicity=True)
+
+
+# Mariani-Silver: iterate a rectangle's border; if every border pixel has the
+# same count the interior is filled with it, otherwise the rectangle is split
+# in four (children share the midlines, so those pixels are computed once).
+# all borders of one level go through escape_time as a single batch. unlike
+# the brute force kernel this can miss detail smaller than a rectangle
+def render_subdivide(x, y, c, max_iter, out, min_size=None):
+    min_size = RENDER_MIN_RECT if min_size is None else min_size
+    h, w = out.shape
+    known = np.zeros((h, w), dtype=bool)
+    need = np.zeros((h, w), dtype=bool)
+    rects = [(0, h, 0, w)]
+    while rects:
+        split = []
+        for r0, r1, c0, c1 in rects:
+            if r1 - r0 <= min_size or c1 - c0 <= min_size:
+                need[r0:r1, c0:c1] = True
+            else:
+                need[r0, c0:c1] = need[r1 - 1, c0:c1] = True
+                need[r0:r1, c0] = need[r0:r1, c1 - 1] = True
+                split.append((r0, r1, c0, c1))
+        need &= ~known
+        rows, cols = np.nonzero(need)
+        if rows.size:
+            out[rows, cols] = _points(x, y, rows, cols, c, max_iter)
+            known |= need
+            need[:] = False
+
+        rects = []
+        for r0, r1, c0, c1 in split:
+            border = np.concatenate((
+                out[r0, c0:c1], out[r1 - 1, c0:c1], out[r0 + 1:r1 - 1, c0], out[r0 + 1:r1 - 1, c1 - 1]
+            ))
+            if (border == border[0]).all():
+                out[r0 + 1:r1 - 1, c0 + 1:c1 - 1] = border[0]
+                known[r0 + 1:r1 - 1, c0 + 1:c1 - 1] = True
+                continue
+            rm, cm = (r0 + r1) // 2, (c0 + c1) // 2
+            rects += [(r0, rm + 1, c0, cm + 1), (r0, rm + 1, cm, c1), (rm, r1, c0, cm + 1), (rm, r1, cm, c1)]
+    return out
+
+
+def render_band(x, y, c, max_iter, out, mode="full"):
+    if mode == "subdivide":
+        return render_subdivide(x, y, c, max_iter, out)
+    z = np.empty((y.size, x.size), dtype=np.complex64)
+    z.real = x
+    z.imag = y[:, np.newaxis]
+    escape_time(z.reshape(-1), c, max_iter, out.reshape(-1))
+    return out
+
+
+def get_pool(workers=RENDER_WORKERS):
+    # persistent per worker count. every forkserver child still re-runs the
+    # launching script as __mp_main__, so compute_service.py must stay
+    # import-safe: no AWS clients, SSM reads or other I/O at module level
+    with _pools_lock:
+        if workers not in _pools:
+            ctx = multiprocessing.get_context("forkserver")
+            ctx.set_forkserver_preload(["julia_kernel"])
+            _pools[workers] = ProcessPoolExecutor(max_workers=workers, mp_context=ctx)
+        return _pools[workers]
+
+
+def warm_render_pool(workers=RENDER_WORKERS):
+    # starts the pool's processes ahead of the first render
+    if workers > 1:
+        get_pool(workers).submit(int).result()
+
+
+def drop_pool(workers, pool):
+    # a pool whose worker died (OOM kill, segfault) refuses all further work
+    with _pools_lock:
+        if _pools.get(workers) is pool:
+            del _pools[workers]
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _render_tile(shm_name, shape, x, y, j, c, max_iter, mode):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        iters = np.ndarray(shape, dtype=np.uint16, buffer=shm.buf)
+        render_band(x, y, c, max_iter, iters[j:j + y.size], mode)
+        del iters
+    finally:
+        shm.close()
+
+
+def render_iterations_parallel(x, y, c, max_iter, workers=RENDER_WORKERS, tile_rows=RENDER_TILE_ROWS, mode="full"):
+    w, h = x.size, y.size
+    shm = shared_memory.SharedMemory(create=True, size=w * h * np.dtype(np.uint16).itemsize)
+    try:
+        for attempt in range(2):
+            pool = get_pool(workers)
+            try:
+                futures = [
+                    pool.submit(_render_tile, shm.name, (h, w), x, y[j:j + tile_rows], j, c, max_iter, mode)
+                    for j in range(0, h, tile_rows)
+                ]
+                for f in futures:
+                    f.result()
+                break
+            except BrokenProcessPool:
+                # replace the pool and render the frame once more
+                drop_pool(workers, pool)
+                if attempt:
+                    raise
+        return np.ndarray((h, w), dtype=np.uint16, buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+# iterations(z) == iterations(-z) bit for bit: (-z)^2 rounds exactly like z^2.
+# if x is exactly antisymmetric, row k with y[k] == -y[j] is row j reversed.
+# returns (rows to render, [(j, k), ...] rows to mirror) or None
+def mirror_rows(x, y):
+    if not np.array_equal(x, -x[::-1]):
+        return None
+    rows = {v: j for j, v in enumerate(y.tolist())}
+    pairs = []
+    for j, v in enumerate(y.tolist()):
+        k = rows.get(-v)
+        if k is not None and k > j:
+            pairs.append((j, k))
+    if not pairs:
+        return None
+    unique = np.ones(y.size, dtype=bool)
+    unique[[k for _, k in pairs]] = False
+    return np.flatnonzero(unique), pairs
+
+
+def render_iterations(x, y, c, max_iter, workers=None, tile_rows=None, symmetry=None, mode=None):
+    workers = RENDER_WORKERS if workers is None else workers
+    tile_rows = RENDER_TILE_ROWS if tile_rows is None else tile_rows
+    symmetry = RENDER_SYMMETRY if symmetry is None else symmetry
+    mode = RENDER_MODE if mode is None else mode
+    if mode not in RENDER_MODES:
+        raise ValueError(f"unknown render mode: {mode}")
+    mirror = mirror_rows(x, y) if symmetry else None
+    if mirror is not None:
+        unique, pairs = mirror
+        iters = np.empty((y.size, x.size), dtype=np.uint16)
+        iters[unique] = render_iterations(x, y[unique], c, max_iter, workers, tile_rows, False, mode)
+        for j, k in pairs:
+            iters[k] = iters[j, ::-1]
+        return iters
+
+    w, h = x.size, y.size
+    if workers > 1 and h > tile_rows:
+        return render_iterations_parallel(x, y, c, max_iter, workers, tile_rows, mode)
+
+    iters = np.empty((h, w), dtype=np.uint16)
+    # subdivision works on whole rectangles and only keeps two masks per pixel
+    rows = h if mode == "subdivide" else max(1, BAND_PIXELS // w)
+    for j in range(0, h, rows):
+        render_band(x, y[j:j + rows], c, max_iter, iters[j:j + rows], mode)
+    return iters
+
+
+def render_bands(x, y, c, max_iter, rows=None, workers=None, tile_rows=None, symmetry=None, mode=None):
+    # yields the frame's iteration counts top to bottom, `rows` at a time.
+    # rows mirroring an earlier row are filled from a temporary file holding
+    # just the mirror sources, so memory stays at one band
+    workers = RENDER_WORKERS if workers is None else workers
+    tile_rows = RENDER_TILE_ROWS if tile_rows is None else tile_rows
+    symmetry = RENDER_SYMMETRY if symmetry is None else symmetry
+    w, h = x.size, y.size
+    rows = rows or max(1, BAND_PIXELS // w, tile_rows * workers)
+    mirror = mirror_rows(x, y) if symmetry else None
+    source_of = dict((k, j) for j, k in mirror[1]) if mirror else {}
+    sources = set(source_of.values())
+    row_bytes = w * np.dtype(np.uint16).itemsize
+
+    with tempfile.TemporaryFile() as spill:
+        for j0 in range(0, h, rows):
+            n = min(rows, h - j0)
+            band = np.empty((n, w), dtype=np.uint16)
+            todo = np.array([j for j in range(j0, j0 + n) if j not in source_of], dtype=np.intp)
+            if todo.size:
+                band[todo - j0] = render_iterations(x, y[todo], c, max_iter, workers, tile_rows, False, mode)
+            for j in range(j0, j0 + n):
+                if j in source_of:
+                    spill.seek(source_of[j] * row_bytes)
+                    band[j - j0] = np.frombuffer(spill.read(row_bytes), dtype=np.uint16)[::-1]
+                elif j in sources:
+                    spill.seek(j * row_bytes)
+                    spill.write(band[j - j0].tobytes())
+            yield band
+
+
+def tile_grid(z, tx, ty, size=256, extent=2.0):
+    # XYZ tile (z, tx, ty) of the square [-extent, extent]^2, y growing down.
+    # pixel centres are exact dyadic fractions, so tile (n-1-tx, n-1-ty) gets
+    # exactly negated coordinates
+    n = (1 << z) * size
+    i = np.arange(size, dtype=np.float64)
+    x = 2 * extent * ((tx * size + i + 0.5) / n) - extent
+    y = extent - 2 * extent * ((ty * size + i + 0.5) / n)
+    return x.astype(np.float32), y.astype(np.float32)
+
+
+def _render_grids(grids, c, max_iter):
+    # every grid's pixels in one flat escape_time call
+    sizes = [x.size * y.size for x, y in grids]
+    z = np.empty(sum(sizes), dtype=np.complex64)
+    pos = 0
+    for (x, y), n in zip(grids, sizes):
+        block = z[pos:pos + n].reshape(y.size, x.size)
+        block.real = x
+        block.imag = y[:, np.newaxis]
+        pos += n
+    out = np.empty(z.size, dtype=np.uint16)
+    escape_time(z, c, max_iter, out)
+    return [part.reshape(y.size, x.size) for part, (x, y) in zip(np.split(out, np.cumsum(sizes)[:-1]), grids)]
+
+
+def render_grids(grids, c, max_iter, workers=None):
+    # many small frames (tiles) at once: batched into one kernel call per
+    # worker so the per-iteration overhead is paid once per batch
+    workers = RENDER_WORKERS if workers is None else workers
+    if workers <= 1 or len(grids) < 2:
+        return _render_grids(grids, c, max_iter)
+    groups = [grids[i::workers] for i in range(min(workers, len(grids)))]
+    pool = get_pool(workers)
+    results = [pool.submit(_render_grids, group, c, max_iter) for group in groups]
+    done = [f.result() for f in results]
+    out = [None] * len(grids)
+    for i, group in enumerate(done):
+        out[i::workers] = group
+    return out
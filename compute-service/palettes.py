@@ -0,0 +1,73 @@
+from functools import lru_cache
+
+import numpy as np
+
+# name -> builder(max_iter) returning a (max_iter + 1, 3) uint8 RGB table
+# indexed directly by iteration count
+_palettes = {}
+
+
+def register_palette(name):
+    def register(builder):
+        _palettes[name] = builder
+        return builder
+    return register
+
+
+def available_palettes():
+    return sorted(_palettes)
+
+
+@lru_cache(maxsize=64)
+def get_lut(name, max_iter):
+    if name not in _palettes:
+        raise ValueError(f"unknown palette: {name}")
+    lut = np.ascontiguousarray(_palettes[name](max_iter), dtype=np.uint8)
+    lut.flags.writeable = False
+    return lut
+
+
+def colorize(iters, name, max_iter):
+    return get_lut(name, max_iter)[iters]
+
+
+@lru_cache(maxsize=64)
+def get_indexed(name, max_iter):
+    # (iteration -> palette index table, flat RGB palette) for a mode "P" image,
+    # or None if the LUT has more than 256 distinct colors
+    colors, index = np.unique(get_lut(name, max_iter), axis=0, return_inverse=True)
+    if len(colors) > 256:
+        return None
+    index = index.reshape(-1).astype(np.uint8)
+    index.flags.writeable = False
+    return index, colors.tobytes()
+
+
+def colorize_indexed(iters, name, max_iter):
+    indexed = get_indexed(name, max_iter)
+    if indexed is None:
+        return None
+    index, palette = indexed
+    return index[iters], palette
+
+
+def _matplotlib_palette(name):
+    # same float64 normalisation as the old per-row cm.inferno(iters / max_iter)
+    # call, so colors stay byte-identical. matplotlib is imported on the first
+    # build, not at start-up
+    def build(max_iter):
+        import matplotlib.cm as cm
+
+        norm = np.arange(max_iter + 1) / max_iter
+        return (getattr(cm, name)(norm)[:, :3] * 255).astype(np.uint8)
+    return build
+
+
+for _name in ("inferno", "magma", "plasma", "viridis", "twilight"):
+    register_palette(_name)(_matplotlib_palette(_name))
+
+
+@register_palette("grayscale")
+def _grayscale(max_iter):
+    levels = (np.arange(max_iter + 1) * 255 // max(max_iter, 1)).astype(np.uint8)
+    return np.repeat(levels[:, np.newaxis], 3, axis=1)
@@ -0,0 +1,83 @@
+import struct
+import zlib
+
+import numpy as np
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# row filters applied before deflate (PNG filter method 0)
+FILTERS = {"none": 0, "sub": 1, "up": 2}
+
+
+def _chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+class PngWriter:
+    # incremental PNG encoder: rows go in band by band and compressed IDAT
+    # chunks are written to `out` as soon as `chunk_size` bytes are ready, so
+    # only one band of pixels and one chunk of output are held at a time.
+    # bands are (n, width, 3) uint8 RGB or, with a palette, (n, width) indexes
+    def __init__(self, out, width, height, palette=None, compress_level=6,
+                 compress_type=zlib.Z_DEFAULT_STRATEGY, filter="none", chunk_size=1 << 18):
+        self.out = out
+        self.width = width
+        self.height = height
+        self.channels = 1 if palette is not None else 3
+        self.filter = FILTERS[filter]
+        self.chunk_size = chunk_size
+        self.rows = 0
+        self._prev = np.zeros(width * self.channels, dtype=np.uint8)
+        self._compress = zlib.compressobj(compress_level, zlib.DEFLATED, 15, 9, compress_type)
+        self._pending = []
+        self._pending_size = 0
+
+        color_type = 3 if palette is not None else 2
+        self.out.write(PNG_SIGNATURE)
+        self.out.write(_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0)))
+        if palette is not None:
+            self.out.write(_chunk(b"PLTE", bytes(palette)))
+
+    def _filtered(self, rows):
+        n = rows.shape[0]
+        data = np.empty((n, 1 + rows.shape[1]), dtype=np.uint8)
+        data[:, 0] = self.filter
+        if self.filter == 1:
+            bpp = self.channels
+            data[:, 1:bpp + 1] = rows[:, :bpp]
+            np.subtract(rows[:, bpp:], rows[:, :-bpp], out=data[:, bpp + 1:])
+        elif self.filter == 2:
+            data[0, 1:] = rows[0] - self._prev
+            np.subtract(rows[1:], rows[:-1], out=data[1:, 1:])
+        else:
+            data[:, 1:] = rows
+        self._prev = rows[-1].copy()
+        return data
+
+    def _emit(self, data):
+        if data:
+            self._pending.append(data)
+            self._pending_size += len(data)
+        if self._pending_size >= self.chunk_size:
+            self._flush()
+
+    def _flush(self):
+        if self._pending_size:
+            self.out.write(_chunk(b"IDAT", b"".join(self._pending)))
+            self._pending = []
+            self._pending_size = 0
+
+    def write_rows(self, band):
+        rows = np.ascontiguousarray(band, dtype=np.uint8).reshape(band.shape[0], -1)
+        if rows.shape[1] != self.width * self.channels:
+            raise ValueError(f"expected rows of {self.width} pixels")
+        if self.rows + rows.shape[0] > self.height:
+            raise ValueError("more rows than the image height")
+        self.rows += rows.shape[0]
+        self._emit(self._compress.compress(self._filtered(rows).tobytes()))
+
+    def close(self):
+        if self.rows != self.height:
+            raise ValueError(f"wrote {self.rows} of {self.height} rows")
+        self._emit(self._compress.flush())
+        self._flush()
+        self.out.write(_chunk(b"IEND", b""))
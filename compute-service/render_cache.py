@@ -0,0 +1,65 @@
+import os
+import json
+import hashlib
+from collections import Counter
+
+# rendered PNGs are stored once per parameter set under this S3 prefix;
+# per-request filenames are server-side copies of these objects
+RENDER_CACHE_PREFIX = os.getenv("RENDER_CACHE_PREFIX", "renders/")
+# optional local disk tier, checked before rendering on an S3 miss
+RENDER_CACHE_DIR = os.getenv("RENDER_CACHE_DIR")
+
+stats = Counter(hits=0, local_hits=0, misses=0)
+
+
+def render_key(a, b, width, height, center, zoom, max_iter, palette, mode="full", image_format="png", extension=".png"):
+    params = {
+        "a": float(a),
+        "b": float(b),
+        "width": int(width),
+        "height": int(height),
+        "center": [float(v) for v in center],
+        "zoom": float(zoom),
+        "max_iter": int(max_iter),
+        "palette": palette,
+    }
+    # subdivided frames can differ from full ones and other containers hold
+    # other bytes; full-mode PNG (RGB or paletted, same pixels) keeps its keys
+    if mode != "full":
+        params["mode"] = mode
+    if image_format != "png":
+        params["format"] = image_format
+    digest = hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+    return f"{RENDER_CACHE_PREFIX}{digest}{extension}"
+
+
+def _local_path(key):
+    return os.path.join(RENDER_CACHE_DIR, os.path.basename(key))
+
+
+def read_local(key):
+    if not RENDER_CACHE_DIR:
+        return None
+    try:
+        with open(_local_path(key), "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def write_local(key, image_bytes):
+    if not RENDER_CACHE_DIR:
+        return
+    os.makedirs(RENDER_CACHE_DIR, exist_ok=True)
+    path = _local_path(key)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(image_bytes)
+    os.replace(tmp, path)
+
+
+def record(outcome):
+    stats[outcome] += 1
+    total = sum(stats.values())
+    hit_rate = (stats["hits"] + stats["local_hits"]) / total
+    print(f"render cache {outcome}: {dict(stats)} hit rate {hit_rate:.1%}")
@@ -0,0 +1,214 @@
+import json
+import time
+import asyncio
+from collections import deque, namedtuple
+
+lane = namedtuple("lane", ["name", "queue_url", "weight"])
+
+
+class _LaneState:
+    def __init__(self, spec, prefetch):
+        self.spec = spec
+        self.prefetch = prefetch
+        self.buffer = deque()
+        self.space = asyncio.Event()
+        self.space.set()
+        self.current = 0
+        self.dispatched = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+
+class SqsConsumer:
+    # one receiver per lane prefetches into a small buffer while jobs run; a
+    # dispatcher picks the next job across lanes by smooth weighted round robin
+    # (up to `concurrency` in flight). received messages are kept invisible with
+    # a heartbeat, deleted in batches, and stop() drains in-flight work
+    def __init__(self, sqs, lanes, handler, concurrency=4, visibility_timeout=120,
+                 heartbeat_interval=30, wait_time=10, delete_interval=1.0, prefetch=2):
+        self.sqs = sqs
+        self.handler = handler
+        self.concurrency = concurrency
+        self.visibility_timeout = visibility_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.wait_time = wait_time
+        self.delete_interval = delete_interval
+
+        self.lanes = [_LaneState(spec, prefetch) for spec in lanes]
+        self._in_flight = set()
+        self._heartbeats = {}
+        self._deletes = {}
+        self._ready = asyncio.Event()
+        self._slot = asyncio.Event()
+        self._stopping = asyncio.Event()
+
+    def stop(self):
+        if not self._stopping.is_set():
+            print("stopping sqs consumer, draining in-flight messages")
+            self._stopping.set()
+            self._ready.set()
+            for state in self.lanes:
+                state.space.set()
+
+    def lane_stats(self):
+        return {
+            state.spec.name: {
+                "buffered": len(state.buffer),
+                "dispatched": state.dispatched,
+                "wait_avg": state.wait_total / state.dispatched if state.dispatched else 0.0,
+                "wait_max": state.wait_max,
+            }
+            for state in self.lanes
+        }
+
+    async def run(self):
+        receivers = [asyncio.create_task(self._receive_loop(state)) for state in self.lanes]
+        deleter = asyncio.create_task(self._delete_loop())
+        try:
+            await self._dispatch_loop()
+        finally:
+            await asyncio.gather(*receivers, return_exceptions=True)
+            for state in self.lanes:
+                await self._release(state)
+            if self._in_flight:
+                await asyncio.gather(*self._in_flight, return_exceptions=True)
+            deleter.cancel()
+            await self._flush_deletes()
+
+    async def _dispatch_loop(self):
+        while not self._stopping.is_set():
+            if len(self._in_flight) >= self.concurrency:
+                self._slot.clear()
+                await self._slot.wait()
+                continue
+
+            ready = [state for state in self.lanes if state.buffer]
+            if not ready:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+
+            # smooth weighted round robin over lanes that have work
+            total = sum(state.spec.weight for state in ready)
+            for state in ready:
+                state.current += state.spec.weight
+            chosen = max(ready, key=lambda state: state.current)
+            chosen.current -= total
+
+            msg = chosen.buffer.popleft()
+            chosen.space.set()
+            self._record_wait(chosen, msg)
+
+            task = asyncio.create_task(self._process(chosen, msg))
+            self._in_flight.add(task)
+            task.add_done_callback(self._job_done)
+
+    def _job_done(self, task):
+        self._in_flight.discard(task)
+        self._slot.set()
+
+    def _record_wait(self, state, msg):
+        sent = msg.get("Attributes", {}).get("SentTimestamp")
+        if sent is None:
+            return
+        wait = max(0.0, time.time() - int(sent) / 1000)
+        state.dispatched += 1
+        state.wait_total += wait
+        state.wait_max = max(state.wait_max, wait)
+        print(f"lane {state.spec.name}: dispatching after {wait:.1f}s in queue")
+
+    async def _receive_loop(self, state):
+        while not self._stopping.is_set():
+            free = state.prefetch - len(state.buffer)
+            if free <= 0:
+                state.space.clear()
+                await state.space.wait()
+                continue
+
+            messages = await self._receive(state, min(free, 10))
+            for msg in messages:
+                self._heartbeats[msg["ReceiptHandle"]] = asyncio.create_task(
+                    self._heartbeat(state.spec.queue_url, msg["ReceiptHandle"])
+                )
+                state.buffer.append(msg)
+            if messages:
+                self._ready.set()
+
+    async def _receive(self, state, count):
+        try:
+            res = await asyncio.to_thread(
+                self.sqs.receive_message,
+                QueueUrl=state.spec.queue_url,
+                MaxNumberOfMessages=count,
+                WaitTimeSeconds=self.wait_time,
+                VisibilityTimeout=self.visibility_timeout,
+                AttributeNames=["SentTimestamp"],
+            )
+            return res.get("Messages", [])
+        except Exception as e:
+            print(f"Failed to receive messages for lane {state.spec.name}: {e}")
+            await asyncio.sleep(1)
+            return []
+
+    async def _process(self, state, msg):
+        receipt_handle = msg["ReceiptHandle"]
+        try:
+            body = json.loads(msg["Body"])
+            await self.handler(body)
+            self._deletes.setdefault(state.spec.queue_url, []).append(receipt_handle)
+        except Exception as e:
+            print(f"Failed to process message: {e}")
+        finally:
+            self._heartbeats.pop(receipt_handle).cancel()
+
+    async def _heartbeat(self, queue_url, receipt_handle):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await asyncio.to_thread(
+                    self.sqs.change_message_visibility,
+                    QueueUrl=queue_url,
+                    ReceiptHandle=receipt_handle,
+                    VisibilityTimeout=self.visibility_timeout,
+                )
+            except Exception as e:
+                print(f"Failed to extend message visibility: {e}")
+
+    async def _delete_loop(self):
+        while True:
+            await asyncio.sleep(self.delete_interval)
+            await self._flush_deletes()
+
+    async def _flush_deletes(self):
+        for queue_url, handles in list(self._deletes.items()):
+            while handles:
+                batch = handles[:10]
+                del handles[:10]
+                entries = [{"Id": str(i), "ReceiptHandle": h} for i, h in enumerate(batch)]
+                try:
+                    res = await asyncio.to_thread(
+                        self.sqs.delete_message_batch, QueueUrl=queue_url, Entries=entries
+                    )
+                    for failed in res.get("Failed", []):
+                        print(f"Failed to delete message: {failed.get('Message')}")
+                except Exception as e:
+                    print(f"Failed to delete messages: {e}")
+
+    async def _release(self, state):
+        # buffered but never started: hand them straight back to the queue
+        while state.buffer:
+            batch = [state.buffer.popleft() for _ in range(min(10, len(state.buffer)))]
+            for msg in batch:
+                self._heartbeats.pop(msg["ReceiptHandle"]).cancel()
+            entries = [
+                {"Id": str(i), "ReceiptHandle": m["ReceiptHandle"], "VisibilityTimeout": 0}
+                for i, m in enumerate(batch)
+            ]
+            try:
+                await asyncio.to_thread(
+                    self.sqs.change_message_visibility_batch,
+                    QueueUrl=state.spec.queue_url,
+                    Entries=entries,
+                )
+            except Exception as e:
+                print(f"Failed to release messages: {e}")
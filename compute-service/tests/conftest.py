@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the service's modules and common/ are imported flat, as in the container
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(SERVICE_DIR), "common"))
+sys.path.insert(0, SERVICE_DIR)
@@ -0,0 +1,91 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+import julia_kernel
+from julia_kernel import julia_grid, mirror_rows, render_iterations
+
+with open(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sets.json")) as f:
+    CONSTANTS = json.load(f)
+
+MAX_ITER = 1000
+
+
+def baseline_rows(x, y, c, max_iter):
+    # the original renderer's loop, row by row, without the coloring
+    iters = np.zeros((y.size, x.size), dtype=np.uint16)
+    for j, y_val in enumerate(y):
+        X_row = x.astype(np.complex64)
+        Y_row = np.full_like(X_row, y_val, dtype=np.float32)
+        Z = X_row + 1j * Y_row
+        alive = np.ones(Z.shape, dtype=bool)
+        for i in range(max_iter):
+            Z[alive] = Z[alive] * Z[alive] + c
+            escaped = np.abs(Z) > 2.0
+            iters[j][escaped & alive] = i
+            alive &= ~escaped
+            if not alive.any():
+                break
+    return iters
+
+
+def constant(index):
+    return np.complex64(complex(CONSTANTS[index]["a"], CONSTANTS[index]["b"]))
+
+
+@pytest.fixture(scope="module")
+def baselines():
+    x, y = julia_grid(48, 27)
+    return x, y, {i: baseline_rows(x, y, constant(i), MAX_ITER) for i in range(len(CONSTANTS))}
+
+
+# one-row bands leave a single live point at the end of many rows, which is
+# where an in-place multiply used to round differently
+@pytest.mark.parametrize("band_pixels", [1 << 20, 48, 7])
+def test_full_render_matches_baseline(baselines, monkeypatch, band_pixels):
+    monkeypatch.setattr(julia_kernel, "BAND_PIXELS", band_pixels)
+    x, y, expected = baselines
+    for i, want in expected.items():
+        got = render_iterations(x, y, constant(i), MAX_ITER, workers=1, symmetry=False, mode="full")
+        assert np.array_equal(got, want), f"constant {i}: {np.count_nonzero(got != want)} pixels differ"
+
+
+SYMMETRY_CONSTANTS = [0, 1, 4, 22, 37, 51]
+
+
+@pytest.mark.parametrize("size", [(48, 27), (49, 27), (48, 28), (49, 28)])
+def test_symmetric_render_matches_full_and_baseline(size):
+    x, y = julia_grid(*size)
+    assert mirror_rows(x, y) is not None, "centred frames should take the mirror shortcut"
+    for i in SYMMETRY_CONSTANTS:
+        c = constant(i)
+        mirrored = render_iterations(x, y, c, MAX_ITER, workers=1, symmetry=True, mode="full")
+        full = render_iterations(x, y, c, MAX_ITER, workers=1, symmetry=False, mode="full")
+        assert np.array_equal(mirrored, full), f"constant {i}: {np.count_nonzero(mirrored != full)} pixels differ"
+        assert np.array_equal(mirrored, baseline_rows(x, y, c, MAX_ITER)), f"constant {i} differs from baseline"
+
+
+def test_off_centre_frame_falls_back_to_full_render():
+    x, y = julia_grid(48, 27, center=(0.2, 0.1))
+    assert mirror_rows(x, y) is None
+    c = constant(4)
+    mirrored = render_iterations(x, y, c, MAX_ITER, workers=1, symmetry=True, mode="full")
+    assert np.array_equal(mirrored, baseline_rows(x, y, c, MAX_ITER))
+
+
+# 22 is mostly never-escaping interior, where whole rectangles get filled and
+# periodicity checking ends points early; 0 and 10 escape within a few
+# iterations almost everywhere, so nearly every rectangle gets split
+SUBDIVIDE_CONSTANTS = [0, 10, 22, 37]
+
+
+@pytest.mark.parametrize("size", [(96, 54), (97, 55)])
+def test_subdivide_matches_full_render(size):
+    x, y = julia_grid(*size)
+    for i in SUBDIVIDE_CONSTANTS:
+        c = constant(i)
+        subdivided = render_iterations(x, y, c, MAX_ITER, workers=1, symmetry=False, mode="subdivide")
+        full = render_iterations(x, y, c, MAX_ITER, workers=1, symmetry=False, mode="full")
+        assert np.array_equal(subdivided, full), f"constant {i}: {np.count_nonzero(subdivided != full)} pixels differ"
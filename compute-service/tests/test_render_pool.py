@@ -0,0 +1,37 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+import julia_kernel
+from julia_kernel import get_pool, julia_grid, render_iterations, render_iterations_parallel
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_broken_pool_is_replaced():
+    x, y = julia_grid(64, 36)
+    c = np.complex64(complex(-0.8, 0.156))
+    pool = get_pool(2)
+    # a worker exiting mid-task breaks the pool for good
+    pool.submit(os._exit, 1).exception()
+
+    got = render_iterations_parallel(x, y, c, 200, workers=2, tile_rows=8)
+    assert np.array_equal(got, render_iterations(x, y, c, 200, workers=1, symmetry=False, mode="full"))
+    assert julia_kernel._pools[2] is not pool
+
+
+def test_compute_service_is_import_safe():
+    # what each render worker does with the launching script
+    script = (
+        "import runpy, sys\n"
+        "runpy.run_path('compute_service.py', run_name='__mp_main__')\n"
+        "print(sorted(m for m in ('boto3', 'botocore') if m in sys.modules))\n"
+    )
+    env = {k: v for k, v in os.environ.items() if not k.startswith("AWS_")}
+    env["PYTHONPATH"] = os.pathsep.join(sys.path)
+    res = subprocess.run([sys.executable, "-c", script], cwd=SERVICE_DIR, env=env,
+                         capture_output=True, text=True, timeout=60)
+    assert res.returncode == 0, res.stderr
+    assert res.stdout.strip().splitlines()[-1] == "[]"
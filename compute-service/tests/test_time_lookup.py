@@ -0,0 +1,43 @@
+import asyncio
+
+import time_lookup
+from time_lookup import TimeLookup
+
+
+def test_reply_after_minute_boundary_expires_with_the_old_minute(monkeypatch):
+    clock = {"now": 119.5}
+    monkeypatch.setattr(time_lookup.time, "time", lambda: clock["now"])
+
+    async def fetch(country, city):
+        clock["now"] = 120.2  # the reply lands in the next minute
+        return "01/01/1970", "00:01"
+
+    async def run():
+        lookup = TimeLookup(fetch, local=False)
+        await lookup.get("Australia", "Brisbane")
+        assert lookup._cache[("Australia", "Brisbane")][1] == 120
+        await lookup.get("Australia", "Brisbane")
+        return lookup.stats
+
+    stats = asyncio.run(run())
+    assert stats["external_calls"] == 2
+    assert stats["cache_hits"] == 0
+
+
+def test_cached_within_the_minute(monkeypatch):
+    monkeypatch.setattr(time_lookup.time, "time", lambda: 100.0)
+    calls = []
+
+    async def fetch(country, city):
+        calls.append((country, city))
+        return "01/01/1970", "00:01"
+
+    async def run():
+        lookup = TimeLookup(fetch, local=False)
+        first = await lookup.get("Europe", "London")
+        second = await lookup.get("Europe", "London")
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first == second == ("01/01/1970", "00:01")
+    assert len(calls) == 1
@@ -0,0 +1,101 @@
+import os
+import json
+import base64
+import asyncio
+
+import numpy as np
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel
+
+from julia_kernel import render_grids, tile_grid, warm_render_pool
+from image_encoding import encode, get_encoding, to_image
+from palettes import available_palettes, get_lut
+import metrics
+from startup import Warmup, health_routes
+
+TILE_SIZE = int(os.getenv("TILE_SIZE", "256"))
+TILE_MAX_ZOOM = int(os.getenv("TILE_MAX_ZOOM", "16"))  # float32 runs out of precision past this
+TILE_MAX_BATCH = int(os.getenv("TILE_MAX_BATCH", "64"))
+# max_iter grows with zoom: deeper tiles need more iterations to resolve detail
+TILE_BASE_ITER = int(os.getenv("TILE_BASE_ITER", "200"))
+TILE_ITER_PER_ZOOM = int(os.getenv("TILE_ITER_PER_ZOOM", "100"))
+TILE_MAX_ITER = int(os.getenv("TILE_MAX_ITER", "2000"))
+TILE_FORMAT = os.getenv("TILE_FORMAT", "png8")  # png or png8
+TILE_SERVER_PORT = int(os.getenv("TILE_SERVER_PORT", "8081"))
+
+with open("sets.json", "r") as f:
+    julia_constants = json.load(f)
+
+warmup = Warmup({
+    "palette": lambda: get_lut("inferno", tile_max_iter(0)),
+    "render_pool": warm_render_pool,
+})
+app = FastAPI(lifespan=warmup.lifespan)
+metrics.instrument(app, "tile-server")
+health_routes(app, warmup)
+
+
+class TileBatchModel(BaseModel):
+    constant: int
+    z: int
+    tiles: list[tuple[int, int]]
+    palette: str = "inferno"
+
+
+def tile_max_iter(z: int):
+    return min(TILE_MAX_ITER, TILE_BASE_ITER + TILE_ITER_PER_ZOOM * z)
+
+
+def render_tiles(constant: int, z: int, tiles, palette: str):
+    c = julia_constants[constant]
+    C = np.complex64(complex(c["a"], c["b"]))
+    max_iter = tile_max_iter(z)
+    enc = get_encoding(TILE_FORMAT)
+
+    # a tile and its 180 degree mirror in the same batch are rendered once
+    n = 1 << z
+    unique = []
+    for tx, ty in tiles:
+        if (n - 1 - tx, n - 1 - ty) not in unique:
+            unique.append((tx, ty))
+    iters = dict(zip(unique, render_grids([tile_grid(z, tx, ty, TILE_SIZE) for tx, ty in unique], C, max_iter)))
+
+    out = {}
+    for tx, ty in tiles:
+        if (tx, ty) in iters:
+            tile = iters[(tx, ty)]
+        else:
+            tile = iters[(n - 1 - tx, n - 1 - ty)][::-1, ::-1]
+        out[(tx, ty)] = encode(to_image(np.ascontiguousarray(tile), palette, max_iter, enc), enc)
+    return out, max_iter
+
+
+@app.post("/tiles/render")
+async def render_tile_batch(req: TileBatchModel):
+    if not 0 <= req.constant < len(julia_constants):
+        raise HTTPException(status_code=404, detail=f"unknown constant {req.constant}")
+    if not 0 <= req.z <= TILE_MAX_ZOOM:
+        raise HTTPException(status_code=400, detail=f"z must be between 0 and {TILE_MAX_ZOOM}")
+    if not req.tiles or len(req.tiles) > TILE_MAX_BATCH:
+        raise HTTPException(status_code=400, detail=f"send between 1 and {TILE_MAX_BATCH} tiles")
+    if req.palette not in available_palettes():
+        raise HTTPException(status_code=400, detail=f"unknown palette {req.palette}")
+    n = 1 << req.z
+    tiles = list(dict.fromkeys((tx, ty) for tx, ty in req.tiles))
+    if any(not (0 <= tx < n and 0 <= ty < n) for tx, ty in tiles):
+        raise HTTPException(status_code=400, detail=f"tile coordinates must be between 0 and {n - 1}")
+
+    with metrics.stage("render_tiles"):
+        rendered, max_iter = await asyncio.to_thread(render_tiles, req.constant, req.z, tiles, req.palette)
+    return {
+        "max_iter": max_iter,
+        "tiles": [
+            {"x": tx, "y": ty, "png_base64": base64.b64encode(data).decode()}
+            for (tx, ty), data in rendered.items()
+        ],
+    }
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=TILE_SERVER_PORT)
@@ -1,10 +1,26 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, HTTPException, Response
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
+from botocore.exceptions import ClientError
 import base64
-from data_service import DataService
+import os
+from data_service import DataService, logger
+import metrics
+from startup import Warmup, health_routes
+
+# most filenames one get_many/set_many call takes
+CACHE_BATCH_MAX = int(os.getenv("CACHE_BATCH_MAX", "500"))
 
-app = FastAPI()
 service = DataService()
+warmup = Warmup({
+    "s3": lambda: service.s3_client,
+    "dynamodb": lambda: service.db_table,
+    "memcached": lambda: service.memcached_client.version(),
+}, optional=("memcached",))
+app = FastAPI(lifespan=warmup.lifespan)
+metrics.instrument(app, "data-service")
+metrics.register_stats("local_cache", lambda: service.local_cache.stats)
+health_routes(app, warmup)
 
 class MetadataModel(BaseModel):
     file_name: str
@@ -17,6 +33,13 @@ class ImageUploadModel(BaseModel):
     key: str
     image_base64: str
 
+class ImageCopyModel(BaseModel):
+    source_key: str
+    key: str
+
+class FilenamesModel(BaseModel):
+    filenames: list[str]
+
 @app.post("/s3/upload")
 def upload_image(req: ImageUploadModel):
     image_bytes = base64.b64decode(req.image_base64)
@@ -24,6 +47,37 @@ def upload_image(req: ImageUploadModel):
     return {"message": "Image uploaded", "key": req.key}
 
 
+@app.put("/s3/object/{key:path}")
+async def upload_image_stream(key: str, request: Request):
+    # raw body, piped into S3 part by part as it arrives
+    upload = service.stream_upload(key, request.headers.get("content-type", "image/png"))
+    try:
+        async for chunk in request.stream():
+            part = upload.feed(chunk)
+            if part is not None:
+                await run_in_threadpool(upload.upload_part, part)
+        await run_in_threadpool(upload.finish)
+    except Exception as e:
+        await run_in_threadpool(upload.abort)
+        logger.error(e)
+        if isinstance(e, ClientError):
+            raise HTTPException(status_code=500, detail=str(e))
+        raise
+    logger.info(f"Streamed image {key} to S3 ({upload.size} bytes, {len(upload.parts)} parts).")
+    return {"message": "Image uploaded", "key": key, "bytes": upload.size}
+
+
+@app.post("/s3/copy")
+def copy_image(req: ImageCopyModel):
+    service.copy_image(req.source_key, req.key)
+    return {"message": "Image copied", "key": req.key}
+
+
+@app.get("/s3/exists/{key:path}")
+def image_exists(key: str):
+    return {"exists": service.image_exists(key)}
+
+
 @app.delete("/s3/{key}")
 def delete_image(key: str):
     service.delete_image(key)
@@ -47,6 +101,24 @@ def get_metadata(filename: str):
     return service.get_metadata(filename)
 
 
+def check_batch(req: FilenamesModel):
+    if len(req.filenames) > CACHE_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"send at most {CACHE_BATCH_MAX} filenames")
+
+
+# declared before /cache/{filename} so they aren't taken for filenames
+@app.post("/cache/get_many")
+def check_cache_many(req: FilenamesModel):
+    check_batch(req)
+    return {"exists": service.check_cache_many(req.filenames)}
+
+
+@app.post("/cache/set_many")
+def cache_files(req: FilenamesModel):
+    check_batch(req)
+    return {"cached": service.cache_filenames(req.filenames)}
+
+
 @app.post("/cache/{filename}")
 def cache_file(filename: str):
     success = service.cache_filename(filename)
@@ -57,3 +129,30 @@ def cache_file(filename: str):
 def check_cache(filename: str):
     exists = service.check_cache(filename)
     return {"exists": exists}
+
+
+@app.post("/cache/{filename}/pending")
+def mark_pending(filename: str):
+    acquired = service.mark_pending(filename)
+    return {"acquired": acquired}
+
+
+@app.delete("/cache/{filename}/pending")
+def clear_pending(filename: str):
+    service.clear_pending(filename)
+    return {"cleared": True}
+
+
+@app.get("/tiles/{key:path}")
+def get_tile(key: str):
+    data = service.get_tile(key)
+    if data is None:
+        raise HTTPException(status_code=404, detail=f"tile {key} not found")
+    return Response(content=data, media_type="image/png")
+
+
+@app.put("/tiles/{key:path}")
+async def put_tile(key: str, request: Request):
+    data = await request.body()
+    await run_in_threadpool(service.put_tile, key, data)
+    return {"message": "Tile stored", "key": key, "bytes": len(data)}
@@ -1,27 +1,157 @@
-import boto3
 import os
 from botocore.exceptions import ClientError
-from pymemcache.client.base import Client
+from pymemcache.client.base import PooledClient
 from fastapi import HTTPException
 import logging
+import time
 
-logging.basicConfig(level=logging.INFO)
+import metrics
+from local_cache import TTLCache
+from startup import aws_client, aws_resource, once
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s:%(name)s:[%(trace_id)s] %(message)s")
+for handler in logging.getLogger().handlers:
+    handler.addFilter(metrics.TraceLogFilter())
 logger = logging.getLogger("data-service")
 
+
+def time_aws_calls(client, service: str):
+    # every API call on the client lands in stage_duration_seconds as
+    # e.g. stage="s3.PutObject"
+    def before(context, **kwargs):
+        context["metrics_start"] = time.perf_counter()
+
+    def after(context, model, **kwargs):
+        start = context.pop("metrics_start", None)
+        if start is not None:
+            metrics.stage_seconds.observe(time.perf_counter() - start, stage=f"{service}.{model.name}")
+
+    client.meta.events.register(f"before-call.{client.meta.service_model.service_name}", before)
+    client.meta.events.register(f"after-call.{client.meta.service_model.service_name}", after)
+
+
+class ImageStreamUpload:
+    # buffers a streamed body into S3 multipart parts; bodies smaller than one
+    # part are written with a single put_object
+    def __init__(self, s3_client, bucket: str, key: str, content_type: str, part_size: int):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.content_type = content_type
+        self.part_size = part_size
+        self.buffer = bytearray()
+        self.upload_id = None
+        self.parts = []
+        self.size = 0
+
+    def feed(self, chunk: bytes):
+        self.buffer += chunk
+        self.size += len(chunk)
+        if len(self.buffer) < self.part_size:
+            return None
+        part, self.buffer = bytes(self.buffer), bytearray()
+        return part
+
+    def upload_part(self, data: bytes):
+        if self.upload_id is None:
+            res = self.s3_client.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, ContentType=self.content_type
+            )
+            self.upload_id = res["UploadId"]
+        number = len(self.parts) + 1
+        res = self.s3_client.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=number,
+            Body=data,
+        )
+        self.parts.append({"ETag": res["ETag"], "PartNumber": number})
+
+    def finish(self):
+        if self.upload_id is None:
+            self.s3_client.put_object(
+                Bucket=self.bucket,
+                Key=self.key,
+                Body=bytes(self.buffer),
+                ContentType=self.content_type,
+            )
+        else:
+            if self.buffer:
+                self.upload_part(bytes(self.buffer))
+            self.s3_client.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=self.upload_id,
+                MultipartUpload={"Parts": self.parts},
+            )
+        self.buffer = bytearray()
+
+    def abort(self):
+        if self.upload_id is not None:
+            self.s3_client.abort_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id
+            )
+
 class DataService:
     def __init__(self):
         self.memcached_endpoint = os.getenv("MEMCACHED_ENDPOINT")
         self.memcached_ttl = int(os.getenv("MEMCACHED_TTL", "300"))
+        self.memcached_pool_size = int(os.getenv("MEMCACHED_POOL_SIZE", "32"))
+        self.memcached_timeout = float(os.getenv("MEMCACHED_TIMEOUT", "1.0"))
+        # in-process L1 for files known to be cached; misses, pending
+        # markers and tiles always go to memcached
+        self.local_cache_size = int(os.getenv("LOCAL_CACHE_SIZE", "10000"))
+        self.local_cache_ttl = float(os.getenv("LOCAL_CACHE_TTL", "5"))
+        self.pending_ttl = int(os.getenv("PENDING_TTL", "600"))
+        self.tile_prefix = os.getenv("TILE_PREFIX", "tiles/")
+        self.tile_ttl = int(os.getenv("TILE_CACHE_TTL", "3600"))
         self.s3_bucket_name = os.getenv("S3_BUCKET_NAME")
         self.aws_region = os.getenv("AWS_REGION", "ap-southeast-2")
         self.presigned_url_expiry = int(os.getenv("PRESIGNED_URL_EXPIRY", "3600"))
+        self.s3_part_size = max(int(os.getenv("S3_PART_SIZE", str(8 * 1024 * 1024))), 5 * 1024 * 1024)
         self.db_table_name = os.getenv("DB_TABLE_NAME")
         self.qut_username = os.getenv("QUT_USERNAME", "default-user")
 
-        self.db_client = boto3.resource("dynamodb", region_name=self.aws_region)
-        self.db_table = self.db_client.Table(self.db_table_name)
-        self.s3_client = boto3.client("s3", region_name=self.aws_region)
-        self.memcached_client = Client(self.memcached_endpoint)
+        # AWS clients are built on first use (or by the router's warm-up)
+        self._db_client = once(self._create_db_client)
+        self._s3_client = once(self._create_s3_client)
+        self._db_table = once(lambda: self.db_client.Table(self.db_table_name))
+        # the threadpool runs sync endpoints concurrently; a plain Client's
+        # one socket would interleave their requests and replies
+        self.memcached_client = PooledClient(
+            self.memcached_endpoint,
+            max_pool_size=self.memcached_pool_size,
+            connect_timeout=self.memcached_timeout,
+            timeout=self.memcached_timeout,
+            no_delay=True,
+        )
+        self.local_cache = TTLCache(
+            self.local_cache_size,
+            min(self.local_cache_ttl, self.memcached_ttl),
+        )
+
+    def _create_db_client(self):
+        db_client = aws_resource("dynamodb", region_name=self.aws_region)
+        time_aws_calls(db_client.meta.client, "dynamodb")
+        return db_client
+
+    def _create_s3_client(self):
+        s3_client = aws_client("s3", region_name=self.aws_region)
+        time_aws_calls(s3_client, "s3")
+        return s3_client
+
+    @property
+    def db_client(self):
+        return self._db_client()
+
+    @property
+    def db_table(self):
+        return self._db_table()
+
+    @property
+    def s3_client(self):
+        return self._s3_client()
 
     # -------- s3 --------
     def write_image(self, key: str, image_bytes: bytes):
@@ -37,6 +167,35 @@ class DataService:
             logger.error(e)
             raise HTTPException(status_code=500, detail=str(e))
 
+    def stream_upload(self, key: str, content_type: str = "image/png"):
+        return ImageStreamUpload(
+            self.s3_client, self.s3_bucket_name, key, content_type, self.s3_part_size
+        )
+
+    def image_exists(self, key: str):
+        try:
+            self.s3_client.head_object(Bucket=self.s3_bucket_name, Key=key)
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                return False
+            logger.error(e)
+            raise HTTPException(status_code=500, detail=str(e))
+
+    def copy_image(self, source_key: str, key: str):
+        try:
+            self.s3_client.copy_object(
+                Bucket=self.s3_bucket_name,
+                Key=key,
+                CopySource={"Bucket": self.s3_bucket_name, "Key": source_key},
+            )
+            logger.info(f"Copied S3 object {source_key} to {key}")
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                raise HTTPException(status_code=404, detail=f"{source_key} not found")
+            logger.error(e)
+            raise HTTPException(status_code=500, detail=str(e))
+
     def delete_image(self, key: str):
         try:
             self.s3_client.delete_object(Bucket=self.s3_bucket_name, Key=key)
@@ -95,14 +254,105 @@ class DataService:
 
     # -------- cache --------
     def cache_filename(self, filename: str):
-        result = self.memcached_client.set(filename, "exists", expire=self.memcached_ttl)
+        # acknowledged, so a check on another pooled connection sees it
+        result = self.memcached_client.set(filename, "exists", expire=self.memcached_ttl, noreply=False)
         if result:
+            self.local_cache.put(filename, b"exists")
             logger.info(f"Cached {filename}")
         else:
             logger.warning(f"Failed to cache {filename}")
         return result
 
     def check_cache(self, filename: str):
-        exists = self.memcached_client.get(filename) is not None
+        value = self.local_cache.get(filename)
+        if value is None:
+            value = self.memcached_client.get(filename)
+            self.local_cache.put(filename, value)
+        exists = value is not None
         logger.info(f"Cache check {filename}: {exists}")
         return exists
+
+    def cache_filenames(self, filenames: list):
+        filenames = list(dict.fromkeys(filenames))
+        failed = set(self.memcached_client.set_many(
+            {filename: "exists" for filename in filenames}, expire=self.memcached_ttl, noreply=False
+        ))
+        for filename in filenames:
+            if filename not in failed:
+                self.local_cache.put(filename, b"exists")
+        if failed:
+            logger.warning(f"Failed to cache {len(failed)} of {len(filenames)} files")
+        logger.info(f"Cached {len(filenames) - len(failed)} files")
+        return {filename: filename not in failed for filename in filenames}
+
+    def check_cache_many(self, filenames: list):
+        # one memcached round trip for whatever the L1 doesn't know to exist
+        values = {}
+        remote = []
+        for filename in dict.fromkeys(filenames):
+            value = self.local_cache.get(filename)
+            if value is None:
+                remote.append(filename)
+            else:
+                values[filename] = value
+        if remote:
+            found = self.memcached_client.get_many(remote)
+            for filename in remote:
+                values[filename] = found.get(filename)
+                self.local_cache.put(filename, values[filename])
+        exists = {filename: value is not None for filename, value in values.items()}
+        logger.info(f"Cache check {len(exists)} files: {sum(exists.values())} cached, {len(remote)} from memcached")
+        return exists
+
+    # atomic: only the first caller gets True until the marker expires or is cleared
+    def mark_pending(self, filename: str):
+        acquired = self.memcached_client.add(
+            f"pending:{filename}", "1", expire=self.pending_ttl, noreply=False
+        )
+        logger.info(f"Pending marker {filename}: {'acquired' if acquired else 'already set'}")
+        return acquired
+
+    def clear_pending(self, filename: str):
+        self.memcached_client.delete(f"pending:{filename}", noreply=False)
+        logger.info(f"Cleared pending marker {filename}")
+
+    # -------- tiles --------
+    # rendered map tiles: S3 is the store, memcached keeps the hot ones
+    def get_tile(self, key: str):
+        try:
+            data = self.memcached_client.get(f"tile:{key}")
+            if data is not None:
+                return data
+        except Exception as e:
+            logger.warning(f"Tile cache read failed for {key}: {e}")
+
+        try:
+            obj = self.s3_client.get_object(Bucket=self.s3_bucket_name, Key=f"{self.tile_prefix}{key}")
+            data = obj["Body"].read()
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                return None
+            logger.error(e)
+            raise HTTPException(status_code=500, detail=str(e))
+        self._cache_tile(key, data)
+        return data
+
+    def put_tile(self, key: str, data: bytes):
+        try:
+            self.s3_client.put_object(
+                Bucket=self.s3_bucket_name,
+                Key=f"{self.tile_prefix}{key}",
+                Body=data,
+                ContentType="image/png",
+            )
+        except ClientError as e:
+            logger.error(e)
+            raise HTTPException(status_code=500, detail=str(e))
+        self._cache_tile(key, data)
+        logger.info(f"Stored tile {key} ({len(data)} bytes)")
+
+    def _cache_tile(self, key: str, data: bytes):
+        try:
+            self.memcached_client.set(f"tile:{key}", data, expire=self.tile_ttl)
+        except Exception as e:
+            logger.warning(f"Tile cache write failed for {key}: {e}")
@@ -0,0 +1,51 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class TTLCache:
+    # in-process LRU in front of memcached, shared by the threadpool's
+    # threads. entries live for `ttl` seconds. misses are never stored:
+    # another uvicorn worker may cache the file at any moment, and nothing
+    # would tell this process to drop a remembered miss. `get` returns None
+    # for unknown or expired keys
+    def __init__(self, max_items=10000, ttl=5.0):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0, "items": 0}
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.stats["misses"] += 1
+                return None
+            value, expires_at = item
+            if expires_at <= now:
+                del self._items[key]
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                self.stats["items"] = len(self._items)
+                return None
+            self._items.move_to_end(key)
+            self.stats["hits"] += 1
+            return value
+
+    def put(self, key, value, ttl=None):
+        if self.max_items <= 0 or value is None:
+            return
+        with self._lock:
+            self._items[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+                self.stats["evictions"] += 1
+            self.stats["items"] = len(self._items)
+
+    def discard(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+            self.stats["items"] = len(self._items)
@@ -0,0 +1,104 @@
+# cold start per service against the load-test stand-ins: how long the
+# service module takes to import in a fresh interpreter, and how long from
+# spawning the process until it answers at all (--live-path) and until it
+# reports ready (--ready-path). --aws-latency and --jwks-latency add a delay
+# to every AWS and JWKS call, as a real network would. services are started
+# one at a time so they don't compete for CPU. times vary by ~0.1s from run
+# to run on one vCPU; compare medians over enough runs, and the ready range
+#   python loadtest/cold_start.py [--repeat 9] [--aws-latency 0.05] [--jwks-latency 0.2]
+#       [--live-path /healthz] [--ready-path /readyz] [--out results.json]
+# code from before /healthz and /readyz existed only serves /metrics; measure
+# it with --live-path /metrics --ready-path /metrics
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+from run import Stack
+
+IMPORTS = {
+    "data-service": "data_router",
+    "auth-service": "auth_app.auth_router",
+    "api-gateway": "api_gateway",
+    "compute-service": "compute_service",
+}
+
+IMPORT_SNIPPET = """
+import time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+
+def import_seconds(service, module):
+    res = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET.format(module=module)],
+        cwd=service.cwd, env=service.env, capture_output=True, text=True, timeout=120,
+    )
+    if res.returncode != 0:
+        raise RuntimeError(f"importing {module} failed:\n{res.stderr[-2000:]}")
+    return float(res.stdout.strip().splitlines()[-1])
+
+
+def start_seconds(service, live_url, ready_url):
+    service.start()
+    try:
+        live = service.wait_for(live_url, interval=0.02)
+        ready = service.wait_for(ready_url, interval=0.02)
+    finally:
+        service.stop()
+    return live, ready
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=9, help="runs per measurement, median reported")
+    parser.add_argument("--aws-latency", type=float, default=0.05, help="seconds added to every AWS call")
+    parser.add_argument("--jwks-latency", type=float, default=0.2, help="seconds per JWKS fetch")
+    parser.add_argument("--live-path", default="/healthz")
+    parser.add_argument("--ready-path", default="/readyz")
+    parser.add_argument("--services", default=",".join(IMPORTS))
+    parser.add_argument("--out", help="write results as JSON")
+    args = parser.parse_args()
+
+    log_dir = tempfile.mkdtemp(prefix="julia-cold-start-")
+    stack = Stack(log_dir, jwks_latency=args.jwks_latency, aws_latency=args.aws_latency)
+    services = stack.services(ready_path=args.ready_path)
+    bases = {"data-service": stack.data_url, "auth-service": stack.auth_url,
+             "api-gateway": stack.gateway_url, "compute-service": stack.metrics_url}
+
+    results = {}
+    try:
+        for name in args.services.split(","):
+            service = services[name]
+            imports = [import_seconds(service, IMPORTS[name]) for _ in range(args.repeat)]
+            starts = [start_seconds(service, bases[name] + args.live_path, service.ready_url)
+                      for _ in range(args.repeat)]
+            results[name] = {
+                "import": statistics.median(imports),
+                "live": statistics.median(live for live, _ in starts),
+                "ready": statistics.median(ready for _, ready in starts),
+                "runs": {"import": imports, "start": starts},
+            }
+    finally:
+        for service in services.values():
+            service.stop()
+        stack.close()
+
+    print(f"median of {args.repeat}, aws latency {args.aws_latency}s, jwks latency {args.jwks_latency}s")
+    print(f"{'service':<16} {'import':>8} {'live':>8} {'ready':>8} {'ready range':>17}")
+    for name, r in results.items():
+        readies = [ready for _, ready in r["runs"]["start"]]
+        print(f"{name:<16} {r['import']:>7.3f}s {r['live']:>7.3f}s {r['ready']:>7.3f}s"
+              f" {min(readies):>7.3f}s-{max(readies):.3f}s")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"config": vars(args), "services": results}, f, indent=2)
+        print(f"wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
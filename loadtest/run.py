@@ -0,0 +1,413 @@
+# local load test: moto (S3/SQS/DynamoDB/SSM/Secrets Manager), a fake
+# memcached, a fake time API and a local JWKS, with the gateway,
+# data-service, auth-service and compute worker started as real processes
+# against them. drives /generate and /get and reports throughput, latency
+# per outcome and queue lag (queued -> cached)
+#   pip install -r loadtest/requirements.txt
+#   python loadtest/run.py [--duration 30] [--rate 5] [--concurrency 8] [--sizes s=2,m=1,l=4,xl=1]
+#       [--hit-ratio 0.5] [--get-ratio 0.2] [--out results.json]
+import os
+import sys
+import json
+import time
+import random
+import signal
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+from zoneinfo import available_timezones
+
+import httpx
+
+from stand_ins import FakeMemcached, Tokens, external_app, latency_proxy, provision, serve, start_moto
+
+ROOT = Path(__file__).resolve().parent.parent
+REGION = "ap-southeast-2"
+CLIENT_ID = "loadtest-client"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * (len(values) - 1) + 0.5))] if values else None
+
+
+class Service:
+    def __init__(self, name, cmd, cwd, env, ready_url, log_dir):
+        self.name = name
+        self.cmd = cmd
+        self.cwd = cwd
+        self.env = env
+        self.ready_url = ready_url
+        self.log_path = Path(log_dir) / f"{name}.log"
+        self.proc = None
+
+    def start(self):
+        self.log = open(self.log_path, "w")
+        self.proc = subprocess.Popen(
+            self.cmd, cwd=self.cwd, env=self.env, stdout=self.log, stderr=subprocess.STDOUT, start_new_session=True
+        )
+        self.started = time.perf_counter()
+
+    def wait_ready(self, timeout=120):
+        return self.wait_for(self.ready_url, timeout)
+
+    def wait_for(self, url, timeout=120, interval=0.2):
+        # seconds from start() until `url` answers 200. one client for all
+        # polls: a new one per poll costs enough CPU to skew start-up timings
+        deadline = time.monotonic() + timeout
+        with httpx.Client(timeout=1) as client:
+            while time.monotonic() < deadline:
+                if self.proc.poll() is not None:
+                    break
+                try:
+                    if client.get(url).status_code == 200:
+                        return time.perf_counter() - self.started
+                except httpx.HTTPError:
+                    pass
+                time.sleep(interval)
+        tail = self.log_path.read_text().splitlines()[-20:]
+        raise RuntimeError(f"{self.name} did not become ready; last log lines:\n" + "\n".join(tail))
+
+    def stop(self):
+        if self.proc is None or self.proc.poll() is not None:
+            return
+        os.killpg(self.proc.pid, signal.SIGTERM)
+        try:
+            self.proc.wait(timeout=20)
+        except subprocess.TimeoutExpired:
+            os.killpg(self.proc.pid, signal.SIGKILL)
+            self.proc.wait()
+        self.log.close()
+
+
+def parse_weights(spec):
+    weights = {}
+    for entry in spec.split(","):
+        name, weight = entry.split("=")
+        weights[name] = float(weight)
+    return weights
+
+
+class Traffic:
+    # /generate for a weighted size mix; with probability hit_ratio a request
+    # repeats an earlier (place, size), otherwise it uses a new time zone. a
+    # get_ratio share of requests are /get for files known to exist
+    def __init__(self, sizes, hit_ratio, get_ratio, tokens, seed):
+        self.rng = random.Random(seed)
+        self.sizes = list(sizes)
+        self.weights = [sizes[s] for s in self.sizes]
+        self.hit_ratio = hit_ratio
+        self.get_ratio = get_ratio
+        zones = sorted(z for z in available_timezones() if z.count("/") == 1 and not z.startswith("Etc/"))
+        self.rng.shuffle(zones)
+        self.zones = zones
+        self.next_zone = 0
+        self.seen = []
+        self.files = []
+        self.headers = {
+            "s": {"Authorization": f"Bearer {tokens.mint('loadtest-user', ['users'])}"},
+            "m": {"Authorization": f"Bearer {tokens.mint('loadtest-admin', ['admin'])}"},
+        }
+
+    def next(self):
+        if self.files and self.rng.random() < self.get_ratio:
+            return "get", f"/get/{self.rng.choice(self.files)}", None, {}
+        if self.seen and self.rng.random() < self.hit_ratio:
+            country, city, size = self.rng.choice(self.seen)
+        else:
+            zone = self.zones[self.next_zone % len(self.zones)]
+            self.next_zone += 1
+            country, city = zone.split("/")
+            size = self.rng.choices(self.sizes, self.weights)[0]
+            self.seen.append((country, city, size))
+        params = {"country": country, "city": city, "size": size}
+        return "generate", "/generate", params, self.headers.get(size, {})
+
+
+async def drive(args, gateway_url, data_url, metrics_url, traffic):
+    samples = []
+    outstanding = {}
+    lags = []
+    depths = []
+    stop = asyncio.Event()
+    next_at = time.perf_counter()
+    limits = httpx.Limits(max_connections=args.concurrency + 8, max_keepalive_connections=args.concurrency + 8)
+
+    async with httpx.AsyncClient(base_url=gateway_url, timeout=120, limits=limits) as client:
+        async def pace():
+            # spreads requests across users to hold --rate overall
+            nonlocal next_at
+            if args.rate:
+                now = time.perf_counter()
+                slot = max(next_at, now)
+                next_at = slot + 1 / args.rate
+                await asyncio.sleep(slot - now)
+
+        async def user():
+            while not stop.is_set():
+                await pace()
+                if stop.is_set():
+                    break
+                kind, path, params, headers = traffic.next()
+                start = time.perf_counter()
+                try:
+                    res = await client.get(path, params=params, headers=headers)
+                    elapsed = time.perf_counter() - start
+                    if res.status_code != 200:
+                        outcome = f"http {res.status_code}"
+                    elif kind == "get":
+                        outcome = "ok"
+                    else:
+                        body = res.json()
+                        outcome = body.get("status") or body.get("error", "unknown")
+                        if outcome == "queued":
+                            outstanding[body["file_name"]] = time.perf_counter()
+                        elif outcome == "cached":
+                            name = httpx.URL(body["url"]).path.rsplit("/", 1)[-1]
+                            if name not in traffic.files:
+                                traffic.files.append(name)
+                except httpx.HTTPError as e:
+                    elapsed = time.perf_counter() - start
+                    outcome = type(e).__name__
+                samples.append((kind, outcome, elapsed, time.perf_counter()))
+
+        async def watch_jobs():
+            # a queued file is done once data-service reports it cached
+            async with httpx.AsyncClient(base_url=data_url, timeout=10) as data:
+                while not stop.is_set() or outstanding:
+                    for name, queued_at in list(outstanding.items()):
+                        try:
+                            res = await data.get(f"/cache/{name}")
+                        except httpx.HTTPError as e:
+                            print(f"job watcher: {type(e).__name__} checking {name}")
+                            continue
+                        if res.status_code == 200 and res.json().get("exists"):
+                            lags.append(time.perf_counter() - queued_at)
+                            del outstanding[name]
+                            traffic.files.append(name)
+                    await asyncio.sleep(0.25)
+
+        async def watch_queue():
+            while not stop.is_set():
+                try:
+                    res = await client.get("/queues")
+                    lanes = res.json()
+                    first = next(iter(lanes.values()))
+                    depths.append((time.perf_counter(), first["waiting"], first["in_flight"]))
+                except Exception:
+                    pass
+                await asyncio.sleep(1)
+
+        start = time.perf_counter()
+        watchers = [asyncio.create_task(watch_jobs()), asyncio.create_task(watch_queue())]
+        users = [asyncio.create_task(user()) for _ in range(args.concurrency)]
+        await asyncio.sleep(args.duration)
+        stop.set()
+        await asyncio.gather(*users)
+        elapsed = time.perf_counter() - start
+        print(f"traffic stopped after {elapsed:.1f}s; waiting up to {args.drain}s for {len(outstanding)} queued jobs")
+        try:
+            await asyncio.wait_for(watchers[0], timeout=args.drain)
+        except asyncio.TimeoutError:
+            pass
+        watchers[1].cancel()
+
+        stages = {}
+        try:
+            res = await client.get(metrics_url)
+            stages = scrape_stages(res.text)
+        except httpx.HTTPError:
+            pass
+
+    return report(samples, elapsed, lags, outstanding, depths, stages)
+
+
+def scrape_stages(text):
+    stages = {}
+    for line in text.splitlines():
+        for suffix in ("_sum", "_count"):
+            prefix = f"stage_duration_seconds{suffix}{{stage=\""
+            if line.startswith(prefix):
+                name = line[len(prefix):line.index('"', len(prefix))]
+                stages.setdefault(name, {})[suffix[1:]] = float(line.rsplit(" ", 1)[1])
+    return {name: {"count": int(s["count"]), "mean": s["sum"] / s["count"]}
+            for name, s in stages.items() if s.get("count")}
+
+
+def report(samples, elapsed, lags, outstanding, depths, stages):
+    groups = {}
+    for kind, outcome, latency, _ in samples:
+        groups.setdefault(f"{kind} {outcome}", []).append(latency)
+    generates = [s for s in samples if s[0] == "generate" and not s[1].startswith("http")]
+    cached = sum(1 for s in generates if s[1] == "cached")
+    return {
+        "seconds": elapsed,
+        "requests": len(samples),
+        "rps": len(samples) / elapsed,
+        "cache_hit_ratio": cached / len(generates) if generates else None,
+        "latency": {
+            name: {"count": len(v), "p50": percentile(v, 0.5), "p99": percentile(v, 0.99), "max": max(v)}
+            for name, v in sorted(groups.items())
+        },
+        "queue_lag": {
+            "completed": len(lags),
+            "outstanding": len(outstanding),
+            "p50": percentile(lags, 0.5),
+            "p99": percentile(lags, 0.99),
+            "max": max(lags) if lags else None,
+        },
+        "queue_depth": {
+            "max_waiting": max((d[1] for d in depths), default=0),
+            "max_in_flight": max((d[2] for d in depths), default=0),
+        },
+        "compute_stages": stages,
+    }
+
+
+def print_report(result):
+    print(f"{result['requests']} requests in {result['seconds']:.1f}s: {result['rps']:.1f} req/s, "
+          f"generate cache hit ratio {result['cache_hit_ratio'] or 0:.1%}")
+    print(f"{'request':<28} {'count':>6} {'p50':>9} {'p99':>9} {'max':>9}")
+    for name, s in result["latency"].items():
+        print(f"{name:<28} {s['count']:>6} {s['p50'] * 1000:>7.1f}ms {s['p99'] * 1000:>7.1f}ms {s['max'] * 1000:>7.1f}ms")
+    lag = result["queue_lag"]
+    if lag["completed"]:
+        print(f"queue lag: {lag['completed']} jobs, p50 {lag['p50']:.2f}s p99 {lag['p99']:.2f}s max {lag['max']:.2f}s, "
+              f"{lag['outstanding']} unfinished")
+    else:
+        print(f"queue lag: no jobs finished, {lag['outstanding']} unfinished")
+    depth = result["queue_depth"]
+    print(f"queue depth: max {depth['max_waiting']} waiting, {depth['max_in_flight']} in flight")
+    if result["compute_stages"]:
+        print("compute stages (mean): " + ", ".join(
+            f"{name} {s['mean']:.3f}s x{s['count']}" for name, s in sorted(result["compute_stages"].items())))
+
+
+class Stack:
+    # the stand-ins, and how to start each service against them
+    def __init__(self, log_dir, time_latency=0.0, jwks_latency=0.0, aws_latency=0.0):
+        self.log_dir = log_dir
+        self.ports = {name: free_port() for name in
+                      ("moto", "aws", "memcached", "external", "data", "auth", "gateway", "metrics")}
+        self.endpoint = f"http://127.0.0.1:{self.ports['moto']}"
+        self.external = f"http://127.0.0.1:{self.ports['external']}"
+        self.data_url = f"http://127.0.0.1:{self.ports['data']}"
+        self.auth_url = f"http://127.0.0.1:{self.ports['auth']}"
+        self.gateway_url = f"http://127.0.0.1:{self.ports['gateway']}"
+        self.metrics_url = f"http://127.0.0.1:{self.ports['metrics']}"
+
+        self.tokens = Tokens(CLIENT_ID)
+        self.moto = start_moto(self.ports["moto"])
+        self.memcached = FakeMemcached(self.ports["memcached"]).start()
+        serve(external_app(self.tokens, time_latency, jwks_latency), self.ports["external"])
+        self.queue_url = provision(self.endpoint, REGION, "julia-loadtest", "julia-loadtest", "julia-jobs",
+                                   f"{self.external}/time/", f"{self.external}/.well-known/jwks.json")
+        if aws_latency:
+            serve(latency_proxy(self.endpoint, aws_latency), self.ports["aws"])
+            self.endpoint = f"http://127.0.0.1:{self.ports['aws']}"
+
+        self.env = {k: v for k, v in os.environ.items()
+                    if not k.startswith(("AWS_", "SQS_", "MEMCACHED_", "JWKS_", "RENDER_"))}
+        self.env.update(
+            AWS_ENDPOINT_URL=self.endpoint, AWS_ACCESS_KEY_ID="loadtest", AWS_SECRET_ACCESS_KEY="loadtest",
+            AWS_REGION=REGION, AWS_DEFAULT_REGION=REGION, PYTHONUNBUFFERED="1",
+        )
+        # the modules in common/ sit next to each service's own in the images
+        self.env["PYTHONPATH"] = os.pathsep.join(
+            p for p in (str(ROOT / "common"), os.environ.get("PYTHONPATH")) if p)
+        # auth-service uses package-relative imports, so it's loaded as a package
+        self.auth_dir = tempfile.mkdtemp(prefix="julia-auth-")
+        os.symlink(ROOT / "auth-service", Path(self.auth_dir) / "auth_app")
+
+    def services(self, gateway_workers=1, sqs_concurrency=2, render_workers=1, auth="local",
+                 ready_path="/readyz", extra_env=None):
+        env = {**self.env, **(extra_env or {})}
+        uvicorn = [sys.executable, "-m", "uvicorn", "--host", "127.0.0.1", "--log-level", "warning"]
+        gateway_env = {**env, "AUTH_SERVICE_URL": self.auth_url, "DATA_SERVICE_URL": self.data_url,
+                       "SQS_QUEUE_URL": self.queue_url, "COGNITO_CLIENT_ID": CLIENT_ID}
+        if auth == "local":
+            gateway_env["JWKS_URL"] = f"{self.external}/.well-known/jwks.json"
+        return {
+            "data-service": Service(
+                "data-service", uvicorn + ["--port", str(self.ports["data"]), "data_router:app"],
+                ROOT / "data-service",
+                {**env, "S3_BUCKET_NAME": "julia-loadtest", "DB_TABLE_NAME": "julia-loadtest",
+                 "MEMCACHED_ENDPOINT": f"127.0.0.1:{self.ports['memcached']}"},
+                self.data_url + ready_path, self.log_dir),
+            "auth-service": Service(
+                "auth-service", uvicorn + ["--port", str(self.ports["auth"]), "--app-dir", self.auth_dir,
+                                           "auth_app.auth_router:app"],
+                self.auth_dir, {**env, "COGNITO_CLIENT_ID": CLIENT_ID}, self.auth_url + ready_path, self.log_dir),
+            "api-gateway": Service(
+                "api-gateway", uvicorn + ["--port", str(self.ports["gateway"]), "--workers", str(gateway_workers),
+                                          "api_gateway:app"],
+                ROOT / "api-gateway", gateway_env, self.gateway_url + ready_path, self.log_dir),
+            "compute-service": Service(
+                "compute-service", [sys.executable, "compute_service.py"], ROOT / "compute-service",
+                {**env, "DATA_SERVICE_URL": self.data_url, "SQS_QUEUE_URL": self.queue_url,
+                 "METRICS_PORT": str(self.ports["metrics"]), "SQS_CONCURRENCY": str(sqs_concurrency),
+                 "RENDER_WORKERS": str(render_workers)},
+                self.metrics_url + ready_path, self.log_dir),
+        }
+
+    def close(self):
+        self.moto.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=5, help="requests per second overall; 0 for as fast as possible")
+    parser.add_argument("--sizes", default="s=2,m=1,l=4,xl=1", help="size=weight mix for /generate")
+    parser.add_argument("--hit-ratio", type=float, default=0.5, help="share of /generate that repeats an earlier place")
+    parser.add_argument("--get-ratio", type=float, default=0.2, help="share of requests that are /get")
+    parser.add_argument("--gateway-workers", type=int, default=1)
+    parser.add_argument("--sqs-concurrency", type=int, default=2)
+    parser.add_argument("--render-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--time-latency", type=float, default=0.05, help="seconds per fake time API call")
+    parser.add_argument("--auth", choices=("local", "service"), default="local",
+                        help="verify tokens in the gateway (JWKS) or send them all to auth-service")
+    parser.add_argument("--drain", type=float, default=120, help="seconds to wait for queued jobs at the end")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--log-dir", default=None)
+    parser.add_argument("--out", help="write results as JSON")
+    args = parser.parse_args()
+
+    log_dir = args.log_dir or tempfile.mkdtemp(prefix="julia-loadtest-")
+    os.makedirs(log_dir, exist_ok=True)
+    stack = Stack(log_dir, args.time_latency)
+    services = list(stack.services(args.gateway_workers, args.sqs_concurrency, args.render_workers, args.auth).values())
+
+    try:
+        for service in services:
+            service.start()
+        for service in services:
+            print(f"{service.name} ready in {service.wait_ready():.1f}s")
+        print(f"service logs in {log_dir}")
+        traffic = Traffic(parse_weights(args.sizes), args.hit_ratio, args.get_ratio, stack.tokens, args.seed)
+        result = asyncio.run(drive(args, stack.gateway_url, stack.data_url, f"{stack.metrics_url}/metrics", traffic))
+    finally:
+        for service in reversed(services):
+            service.stop()
+        stack.close()
+
+    result["config"] = {k: v for k, v in vars(args).items() if k not in ("out", "log_dir")}
+    result["memcached"] = stack.memcached.stats
+    print_report(result)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+import time
+import asyncio
+import logging
+import threading
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+import boto3
+import uvicorn
+from fastapi import FastAPI, HTTPException
+from jose import jwk, jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+# names the services read at import
+EXTERNAL_API_PARAMETER = "/n10807144-a2/external-api"
+JWKS_URL_PARAMETER = "/n10807144-a2/jwks-url"
+CLIENT_SECRET_ID = "JULIA_CLIENT_SECRET"
+
+
+def serve(app, port):
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def start_moto(port):
+    # S3, SQS, DynamoDB, SSM and Secrets Manager on one local endpoint; the
+    # services reach it through AWS_ENDPOINT_URL
+    from moto.server import ThreadedMotoServer
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+    server.start()
+    return server
+
+
+def latency_proxy(target, latency):
+    # forwards everything to `target` after `latency` seconds, so AWS calls
+    # cost about what they would over a real network
+    import httpx
+    from starlette.requests import Request
+    from starlette.responses import Response
+
+    client = httpx.AsyncClient(base_url=target, timeout=60)
+
+    async def app(scope, receive, send):
+        if scope["type"] != "http":
+            return
+        request = Request(scope, receive)
+        await asyncio.sleep(latency)
+        upstream = await client.request(
+            request.method,
+            request.url.path,
+            params=request.url.query,
+            headers=[(k, v) for k, v in request.headers.items() if k != "host"],
+            content=await request.body(),
+        )
+        headers = {k: v for k, v in upstream.headers.items()
+                   if k not in ("content-length", "content-encoding", "transfer-encoding")}
+        await Response(upstream.content, upstream.status_code, headers)(scope, receive, send)
+
+    return app
+
+
+def provision(endpoint, region, bucket, table, queue, external_api_url, jwks_url):
+    def client(name):
+        return boto3.client(name, region_name=region, endpoint_url=endpoint,
+                            aws_access_key_id="loadtest", aws_secret_access_key="loadtest")
+
+    client("s3").create_bucket(Bucket=bucket, CreateBucketConfiguration={"LocationConstraint": region})
+    client("dynamodb").create_table(
+        TableName=table,
+        KeySchema=[
+            {"AttributeName": "qut-username", "KeyType": "HASH"},
+            {"AttributeName": "filename", "KeyType": "RANGE"},
+        ],
+        AttributeDefinitions=[
+            {"AttributeName": "qut-username", "AttributeType": "S"},
+            {"AttributeName": "filename", "AttributeType": "S"},
+        ],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    queue_url = client("sqs").create_queue(QueueName=queue)["QueueUrl"]
+    ssm = client("ssm")
+    ssm.put_parameter(Name=EXTERNAL_API_PARAMETER, Value=external_api_url, Type="SecureString")
+    ssm.put_parameter(Name=JWKS_URL_PARAMETER, Value=jwks_url, Type="SecureString")
+    client("secretsmanager").create_secret(
+        Name=CLIENT_SECRET_ID, SecretString='{"COGNITO_CLIENT_SECRET": "loadtest"}'
+    )
+    return queue_url
+
+
+class Tokens:
+    # RS256 key pair standing in for the Cognito user pool
+    def __init__(self, client_id, kid="loadtest"):
+        self.client_id = client_id
+        self.kid = kid
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self.private_pem = key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        )
+        public_pem = key.public_key().public_bytes(
+            serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+        )
+        self.jwks = {"keys": [{**jwk.construct(public_pem, "RS256").to_dict(), "kid": kid, "use": "sig"}]}
+
+    def mint(self, username, groups=(), ttl=3600):
+        now = int(time.time())
+        claims = {
+            "sub": username,
+            "cognito:username": username,
+            "cognito:groups": list(groups),
+            "aud": self.client_id,
+            "token_use": "id",
+            "iat": now,
+            "exp": now + ttl,
+        }
+        return jwt.encode(claims, self.private_pem, algorithm="RS256", headers={"kid": self.kid})
+
+
+def external_app(tokens, latency=0.0, jwks_latency=0.0, date_format="%m/%d/%Y", time_format="%H:%M"):
+    # the time API and the user pool's JWKS
+    app = FastAPI()
+    calls = {"time": 0, "jwks": 0}
+
+    @app.get("/.well-known/jwks.json")
+    async def get_jwks():
+        calls["jwks"] += 1
+        await asyncio.sleep(jwks_latency)
+        return tokens.jwks
+
+    @app.get("/time/{zone:path}")
+    async def current_time(zone: str):
+        calls["time"] += 1
+        await asyncio.sleep(latency)
+        try:
+            now = datetime.now(timezone.utc).astimezone(ZoneInfo(zone))
+        except Exception:
+            raise HTTPException(status_code=404, detail=f"unknown zone {zone}")
+        return {"date": now.strftime(date_format), "time": now.strftime(time_format)}
+
+    app.state.calls = calls
+    return app
+
+
+class FakeMemcached:
+    # enough of the memcached text protocol for pymemcache: get/gets, set,
+    # add, delete, touch, version and flush_all, with expiry
+    def __init__(self, port):
+        self.port = port
+        self.items = {}
+        self.stats = {"get_hits": 0, "get_misses": 0, "sets": 0}
+        self._loop = asyncio.new_event_loop()
+        self._started = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+        self._started.wait()
+        return self
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        server = self._loop.run_until_complete(asyncio.start_server(self._handle, "127.0.0.1", self.port))
+        self._started.set()
+        self._loop.run_until_complete(server.serve_forever())
+
+    def _expiry(self, exptime):
+        if exptime == 0:
+            return None
+        if exptime < 0:
+            return 0
+        return exptime if exptime > 30 * 24 * 3600 else time.time() + exptime
+
+    def _get(self, key):
+        item = self.items.get(key)
+        if item is not None and item[2] is not None and item[2] <= time.time():
+            del self.items[key]
+            item = None
+        return item
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                parts = line.decode().split()
+                if not parts:
+                    continue
+                command, args = parts[0], parts[1:]
+                noreply = bool(args) and args[-1] == "noreply"
+                if noreply:
+                    args = args[:-1]
+
+                if command in ("get", "gets"):
+                    out = []
+                    for key in args:
+                        item = self._get(key)
+                        if item is None:
+                            self.stats["get_misses"] += 1
+                            continue
+                        self.stats["get_hits"] += 1
+                        cas = f" {id(item)}" if command == "gets" else ""
+                        out.append(f"VALUE {key} {item[1]} {len(item[0])}{cas}\r\n".encode() + item[0] + b"\r\n")
+                    reply = b"".join(out) + b"END\r\n"
+                elif command in ("set", "add", "replace"):
+                    key, flags, exptime, size = args[0], int(args[1]), int(args[2]), int(args[3])
+                    data = (await reader.readexactly(size + 2))[:-2]
+                    exists = self._get(key) is not None
+                    if (command == "add" and exists) or (command == "replace" and not exists):
+                        reply = b"NOT_STORED\r\n"
+                    else:
+                        self.items[key] = (data, flags, self._expiry(exptime))
+                        self.stats["sets"] += 1
+                        reply = b"STORED\r\n"
+                elif command == "delete":
+                    reply = b"DELETED\r\n" if self.items.pop(args[0], None) is not None else b"NOT_FOUND\r\n"
+                elif command == "touch":
+                    item = self._get(args[0])
+                    if item is None:
+                        reply = b"NOT_FOUND\r\n"
+                    else:
+                        self.items[args[0]] = (item[0], item[1], self._expiry(int(args[1])))
+                        reply = b"TOUCHED\r\n"
+                elif command == "version":
+                    reply = b"VERSION 1.6.0-loadtest\r\n"
+                elif command == "flush_all":
+                    self.items.clear()
+                    reply = b"OK\r\n"
+                elif command == "quit":
+                    break
+                else:
+                    reply = b"ERROR\r\n"
+
+                if not noreply:
+                    writer.write(reply)
+                    await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()